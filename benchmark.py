@@ -0,0 +1,285 @@
+"""
+Benchmark reprodutível do pipeline com exports de OS sintéticos.
+
+    python benchmark.py gerar 100000 os_100k.csv            # só gera o arquivo
+    python benchmark.py rodar --linhas 10000,100000 --formato csv,xlsx --saida bench.jsonl
+    python benchmark.py comparar antes.jsonl depois.jsonl
+
+Cada medição vira uma linha JSON (etapa, linhas, formato, tempos, versões), então
+execuções de releases diferentes podem ser comparadas.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+# =========================
+# Gerador sintético
+# =========================
+COMPONENTES = [
+    "chassi", "suporte do tanque", "parafuso da grade", "facão", "plataforma", "barra de corte",
+    "freio", "pastilha de freio", "amortecedor", "feixe de mola", "caixa de direção", "orbitrol",
+    "chicote elétrico", "farol", "bateria", "alternador", "painel", "sensor de rotação", "modulo",
+    "bomba hidráulica", "pneu", "roda", "câmara", "rolete", "esteira", "ar condicionado",
+    "compressor do ar", "embreagem", "câmbio", "diferencial", "motor", "cabeçote", "turbina",
+    "retentor", "filtro de combustível", "tanque", "vidro", "porta", "retrovisor",
+]
+ACOES = ["troca de", "reparo no", "verificar", "ajuste do", "soldar", "substituir", "revisar", "limpeza do"]
+VAZAMENTOS = [
+    "vazamento de óleo no", "vazamento de diesel na", "mangueira rompida do", "mangueira vazando no",
+    "vazamento de combustível", "flexível estourado", "vazando óleo hidráulico no",
+]
+GENERICOS = ["equipamento parado", "barulho estranho", "não liga", "avaria", "ver com operador", "outros"]
+PLANEJADAS = ["preventiva 250h", "revisão programada", "lubrificação geral", "inspeção", "PM2", "plano de manutenção"]
+TP_OS = ["Corretiva", "Corretiva", "Corretiva", "Preventiva", "Programada", "Preditiva", "Inspeção"]
+
+
+def _pool_descricoes(rng, n: int) -> list:
+    pool = []
+    for _ in range(n):
+        r = rng.random()
+        comp = COMPONENTES[rng.integers(len(COMPONENTES))]
+        if r < 0.20:
+            txt = f"{VAZAMENTOS[rng.integers(len(VAZAMENTOS))]} {comp}"
+        elif r < 0.75:
+            txt = f"{ACOES[rng.integers(len(ACOES))]} {comp}"
+        elif r < 0.88:
+            txt = GENERICOS[rng.integers(len(GENERICOS))]
+        else:
+            txt = PLANEJADAS[rng.integers(len(PLANEJADAS))]
+        if rng.random() < 0.3:
+            txt = txt.upper() if rng.random() < 0.5 else txt.capitalize()
+        if rng.random() < 0.2:
+            txt += f" - {rng.choice(['lado esquerdo', 'LD', 'urgente', 'frente de colheita', 'oficina'])}."
+        pool.append(txt)
+    return pool
+
+
+def gerar_os(n: int, seed: int = 42, inicio: str = "2022-01-01", dias: int = 900) -> pd.DataFrame:
+    """
+    Export sintético com o layout do ERP: descrições repetidas (Zipf) com frases de
+    vazamento/mangueira/combustível, CD_EQUIPTO enviesado, todos os CD_CLASMANU e datas
+    ENTRADA/SAIDA em texto dd/mm/aaaa hh:mm. Mesmo `seed` -> mesmo arquivo.
+    """
+    rng = np.random.default_rng(seed)
+
+    # poucos milhares de descrições distintas repetidas + uma fração única (com nº)
+    n_pool = int(min(20000, max(200, n ** 0.6)))
+    pool = np.array(_pool_descricoes(rng, n_pool), dtype=object)
+    desc = pool[np.minimum(rng.zipf(1.3, n) - 1, n_pool - 1)]
+    unicos = rng.random(n) < 0.05
+    desc[unicos] = [f"{d} OS {i}" for d, i in zip(desc[unicos], rng.integers(1, 10**6, unicos.sum()))]
+
+    n_equip = int(min(5000, max(50, n // 200)))
+    equip = (np.minimum(rng.zipf(1.5, n), n_equip) + 10000).astype(float)
+    equip[rng.random(n) < 0.01] = np.nan
+
+    codigos = np.array(list(pipeline.CLASMANU_MAP) + [np.nan], dtype=float)
+    pesos = np.array([40, 15, 5, 3, 8, 6, 3, 4, 5, 2, 2, 7], dtype=float)
+    clas = rng.choice(codigos, n, p=pesos / pesos.sum())
+
+    entrada = pd.Timestamp(inicio) + pd.to_timedelta(rng.integers(0, dias * 24 * 4, n) * 15, unit="min")
+    saida = entrada + pd.to_timedelta(rng.gamma(1.5, 12.0, n), unit="h").round("min")
+    sem_saida = rng.random(n) < 0.03
+
+    df = pd.DataFrame({
+        "NR_OS": np.arange(1, n + 1) + 500000,
+        "CD_EQUIPTO": equip,
+        "CD_CLASMANU": clas,
+        "TP_OS": rng.choice(TP_OS, n),
+        "DE_SERVICO": desc,
+        "ENTRADA": entrada.strftime("%d/%m/%Y %H:%M"),
+        "SAIDA": pd.Series(saida.strftime("%d/%m/%Y %H:%M")).where(~sem_saida, ""),
+    })
+    return df
+
+
+def gravar_os(df: pd.DataFrame, caminho: str):
+    if caminho.lower().endswith((".xlsx", ".xls")):
+        if len(df) > 1_048_575:
+            raise ValueError("XLSX suporta no máximo 1.048.575 linhas de dados")
+        df.to_excel(caminho, index=False)
+    else:
+        df.to_csv(caminho, sep=";", index=False, encoding="latin1", errors="replace")
+
+
+# =========================
+# Execução das medições
+# =========================
+def _versoes() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10,
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "regras": pipeline.RULES_VERSION,
+        "cpus": os.cpu_count(),
+    }
+
+
+def _cronometrar(fn, repeticoes: int, preparar=None) -> list:
+    tempos = []
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        t0 = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - t0)
+    return tempos
+
+
+def medir_arquivo(caminho: str, n: int, formato: str, repeticoes: int, tmp: str) -> list:
+    """Mede cada etapa do pipeline sobre um arquivo; devolve uma lista de registros."""
+    resultados = []
+
+    def registrar(etapa, tempos, **extra):
+        resultados.append({
+            "etapa": etapa, "linhas": n, "formato": formato, "repeticoes": len(tempos),
+            "min_s": round(min(tempos), 5), "mediana_s": round(statistics.median(tempos), 5), **extra,
+        })
+        print(f"  {etapa:<28} {formato:<5} {n:>9}  mediana {statistics.median(tempos):8.3f}s", flush=True)
+
+    # caches em pasta temporária: "frio" limpa antes de cada repetição
+    pipeline.INGEST_CACHE_DIR = os.path.join(tmp, "ingest")
+    pipeline.CLASSIF_CACHE_PATH = os.path.join(tmp, "classif.sqlite")
+
+    def limpar_ingest():
+        for f in os.listdir(pipeline.INGEST_CACHE_DIR) if os.path.isdir(pipeline.INGEST_CACHE_DIR) else []:
+            os.remove(os.path.join(pipeline.INGEST_CACHE_DIR, f))
+
+    registrar("ingestao_fria", _cronometrar(lambda: pipeline.carregar_dados(caminho), repeticoes, limpar_ingest))
+    registrar("ingestao_cache", _cronometrar(lambda: pipeline.carregar_dados(caminho), repeticoes))
+    if formato == "csv":
+        registrar("ingestao_em_blocos", _cronometrar(lambda: pipeline.carregar_dados_em_blocos(caminho), repeticoes))
+
+    df_raw = pipeline.carregar_dados(caminho)
+    registrar("filtro_planejadas", _cronometrar(lambda: pipeline.aplicar_filtro_nao_programadas(df_raw), repeticoes))
+    df = pipeline.aplicar_filtro_nao_programadas(df_raw)[0]
+
+    textos = df["DE_SERVICO_N"]
+    registrar("regras_sem_cache", _cronometrar(lambda: pipeline.classify_rules_batch(textos, use_cache=False), repeticoes),
+              distintas=int(textos.nunique()))
+    pipeline.classify_rules_batch(textos)  # aquece o SQLite
+    registrar("regras_cache_sqlite", _cronometrar(lambda: pipeline.classify_rules_batch(textos), repeticoes))
+    comp = pipeline.classify_rules_batch(textos)
+
+    df_clf = df[["DE_SERVICO_N"]].assign(Comp_Rules=comp)
+    registrar("ml_reclass_frio", _cronometrar(
+        lambda: pipeline.ml_reclass_optional(df_clf, "DE_SERVICO_N", "Comp_Rules"), repeticoes,
+        preparar=pipeline._ML_MODELS.clear,
+    ))
+    registrar("ml_reclass_cache", _cronometrar(
+        lambda: pipeline.ml_reclass_optional(df_clf, "DE_SERVICO_N", "Comp_Rules", threshold=0.7), repeticoes,
+    ))
+    registrar("ml_reclass_hashing_frio", _cronometrar(
+        lambda: pipeline.ml_reclass_optional(df_clf, "DE_SERVICO_N", "Comp_Rules", backend="hashing"), repeticoes,
+        preparar=pipeline._ML_MODELS.clear,
+    ))
+
+    registrar("montar_cubo", _cronometrar(lambda: pipeline.montar_cubo(df, comp), repeticoes))
+    cubo = pipeline.montar_cubo(df, comp)
+    ano, semanas = pipeline.selecao_padrao(df)
+    sel = pipeline.selecionar_cubo(cubo, ano, semanas)
+    tabelas = {
+        "grafico1_componentes": lambda: pipeline.tabela_componentes(sel),
+        "grafico2_classes": lambda: pipeline.tabela_classes(sel),
+        "grafico3_os_equipamento": lambda: pipeline.tabela_os_equipamento(sel),
+        "grafico4_horas_equipamento": lambda: pipeline.tabela_horas_equipamento(sel),
+        "grafico5_diaria": lambda: pipeline.tabela_diaria(sel),
+        "grafico6_mensal": lambda: pipeline.tabela_mensal(df),
+        "selecao_semanas": lambda: pipeline.selecionar_cubo(cubo, ano, semanas),
+    }
+    for nome, fn in tabelas.items():
+        registrar(nome, _cronometrar(fn, repeticoes))
+    return resultados
+
+
+def rodar(args) -> int:
+    versoes = _versoes()
+    ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    todos = []
+    with tempfile.TemporaryDirectory(prefix="bench_os_") as tmp:
+        for n in args.linhas:
+            df_os = gerar_os(n, seed=args.seed)
+            for formato in args.formato:
+                if formato == "xlsx" and n > 1_048_575:
+                    print(f"  (pulando xlsx com {n} linhas: acima do limite do Excel)")
+                    continue
+                caminho = os.path.join(tmp, f"os_{n}.{formato}")
+                gravar_os(df_os, caminho)
+                print(f"{os.path.basename(caminho)} ({os.path.getsize(caminho) / 2**20:.1f} MB)")
+                with tempfile.TemporaryDirectory(dir=tmp) as caches:
+                    todos += medir_arquivo(caminho, n, formato, args.repeticoes, caches)
+                os.remove(caminho)
+
+    linhas = "".join(json.dumps({"ts": ts, "seed": args.seed, **versoes, **r}, ensure_ascii=False) + "\n" for r in todos)
+    with open(args.saida, "a", encoding="utf-8") as f:
+        f.write(linhas)
+    print(f"{len(todos)} medições gravadas em {args.saida}")
+    return 0
+
+
+def comparar(args) -> int:
+    def carregar(caminho):
+        df = pd.read_json(caminho, lines=True)
+        return df.groupby(["etapa", "formato", "linhas"])["mediana_s"].last()
+
+    a, b = carregar(args.antes), carregar(args.depois)
+    tab = pd.concat({"antes_s": a, "depois_s": b}, axis=1).dropna()
+    tab["razao"] = (tab["depois_s"] / tab["antes_s"]).round(2)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(tab.sort_index())
+    return 0
+
+
+def _lista(tipo):
+    return lambda txt: [tipo(x) for x in txt.split(",") if x.strip()]
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark do pipeline de OS com dados sintéticos.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("gerar", help="gera um export sintético (.csv ou .xlsx)")
+    g.add_argument("linhas", type=int)
+    g.add_argument("arquivo")
+    g.add_argument("--seed", type=int, default=42)
+
+    r = sub.add_parser("rodar", help="gera os arquivos e mede cada etapa")
+    r.add_argument("--linhas", type=_lista(int), default=[10_000, 100_000],
+                   help="tamanhos, ex.: 10000,100000,1000000,5000000")
+    r.add_argument("--formato", type=_lista(str), default=["csv"], help="csv, xlsx ou ambos (csv,xlsx)")
+    r.add_argument("--repeticoes", type=int, default=3)
+    r.add_argument("--seed", type=int, default=42)
+    r.add_argument("--saida", default="bench_resultados.jsonl", help="arquivo JSON lines (acrescenta)")
+
+    c = sub.add_parser("comparar", help="compara medianas de duas execuções")
+    c.add_argument("antes")
+    c.add_argument("depois")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "gerar":
+        gravar_os(gerar_os(args.linhas, seed=args.seed), args.arquivo)
+        return 0
+    return rodar(args) if args.cmd == "rodar" else comparar(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,24 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
 import streamlit as st
 import pandas as pd
-import altair as alt
-import re, unicodedata
+
+import pipeline
+from pipeline import (
+    CLASMANU_MAP,
+    selecionar_cubo, semanas_disponiveis, mascara_filtro, componentes_finais,
+    tabela_componentes_linhas, tabela_classes, tabela_os_equipamento,
+    tabela_horas_equipamento, tabela_diaria, tabela_mensal, tabela_nao_classificadas,
+    grafico_componentes, grafico_classes, grafico_os_equipamento,
+    grafico_horas_equipamento, grafico_diario, grafico_mensal, agrupar_serie,
+    tabela_confiabilidade, grafico_confiabilidade,
+)
 
 # =========================
 # Config & título
@@ -9,569 +26,538 @@ import re, unicodedata
 st.set_page_config(layout="wide")
 st.title("Dashboard de Manutenção — Ordens de Serviço")
 
-# cor padrão dos gráficos (verde)
-COLOR = "#2E7D32"
-
-# --- categorias novas de vazamento (nomes padronizados) ---
-LEAK_FUEL = "Vazamento – Combustível"
-LEAK_OIL  = "Vazamento – Óleo (geral)"
-LEAK_HOSE = "Vazamento – Mangueira"
-
-# nomes “bonitos” no gráfico de componentes
-DISPLAY_RENAME = {
-    LEAK_OIL:  "Vaz. Óleo (geral)",
-    LEAK_FUEL: "Vaz. Combustível",
-    LEAK_HOSE: "Vaz. Mangueira",
-
-    "Pneus/Rodagem": "Rodagem (Pneus)",
-    "Estrutural/Chassi": "Estrutural / Chassi",
-    "Corte/Facão & Plataforma": "Plataforma / Corte",
-    "Cabine/Carroceria": "Carroceria / Cabine",
-    "Falha Eletrônica / Painel": "Eletrônica / Painel",
-    "Ar Condicionado": "Ar Condicionado (AC)",
-    "Transmissão / Câmbio": "Transmissão / Câmbio",
-}
-
-# ====== Mapa de códigos -> descrição (CD_CLASMANU) ======
-CLASMANU_MAP = {
-    12: "CORRETIVA",
-    14: "PREVENTIVA SISTEMÁTICA",
-    15: "PREDITIVA",
-    16: "CENTRO DE CUSTO",
-    17: "PREVENTIVA CONDICIONAL",
-    18: "ENTRESSAFRA",
-    19: "MELHORIA/CAPEX",
-    20: "ENTRESSAFRA S/PLANO",
-    21: "SRS/MINI REFORMA",
-    23: "TECNOLOGIA AGRÍCOLA",
-    24: "GEOTECNOLOGIA",
-}
-
-def _to_int_code(x):
-    """Converte '12', '12.0', 12.0 etc para int 12; retorna None se não der."""
-    s = str(x).strip()
-    if not s or s.lower() == "nan":
-        return None
-    s = s.replace(",", ".")
-    try:
-        return int(float(s))
-    except:
-        m = re.search(r"\d+", s)
-        return int(m.group()) if m else None
-
-# =========================
-# Utils
 # =========================
-def norm_txt(s: str) -> str:
-    if not isinstance(s, str):
-        return ""
-    s = s.lower().strip()
-    s = unicodedata.normalize("NFKD", s).encode("ASCII", "ignore").decode("ASCII")
-    s = re.sub(r"[_\-.,;:/\\]+", " ", s)
-    s = re.sub(r"\s+", " ", s)
-    return s
-
+# Desempenho (profiling) — ligado por execução
 # =========================
-# Carregamento (CSV/Excel)
-# =========================
-@st.cache_data(show_spinner=False)
-def carregar_dados(arquivo):
-    nome = getattr(arquivo, "name", "")
-    tipo = getattr(arquivo, "type", "")
-
-    # Excel?
-    if str(nome).lower().endswith((".xlsx", ".xls")) or "excel" in str(tipo).lower():
-        df = pd.read_excel(arquivo, sheet_name=0)
-    else:
-        # CSV: tenta latin-1 e ';', depois autoinferência
+painel_perf = st.sidebar.expander("Desempenho (profiling)", expanded=False)
+medir = painel_perf.checkbox("Medir etapas desta execução", value=False)
+medir_mem = painel_perf.checkbox("Incluir pico de memória (tracemalloc, mais lento)", value=False, disabled=not medir)
+if medir:
+    pipeline.iniciar_medicao(memoria=medir_mem)
+
+# st.stop(), erro ou rerun pedido no meio da execução interrompem o script: o finally
+# encerra a medição mesmo assim (senão o tracemalloc, que é do processo, ficaria ligado)
+try:
+    def medir_cache(nome):
+        """Registra tempo e hit/miss de uma função com cache do Streamlit (o corpo chama registrar_execucao)."""
+        def deco(fn_cacheada):
+            def wrapper(*args):
+                with pipeline.etapa(nome, cache="streamlit") as reg:
+                    n = pipeline.execucoes(nome)
+                    out = fn_cacheada(*args)
+                    reg["hit"] = pipeline.execucoes(nome) == n
+                return out
+            return wrapper
+        return deco
+
+    def mostrar_grafico(nome, chart):
+        # mede a serialização do Altair + envio ao navegador
+        with pipeline.etapa(f"render_{nome}"):
+            st.altair_chart(chart, use_container_width=True)
+
+    # =========================
+    # Base compartilhada entre sessões (a lógica fica em pipeline.py)
+    # =========================
+    # Copy-on-Write: recortes e colunas criados por uma sessão nunca escrevem na base
+    # compartilhada (já é o comportamento padrão a partir do pandas 3)
+    if int(pd.__version__.split(".")[0]) == 2:
+        pd.set_option("mode.copy_on_write", True)
+
+    @medir_cache("st_base_compartilhada")
+    @st.cache_resource(show_spinner=False, max_entries=4)
+    def base_compartilhada(chave: str, em_blocos: bool, _arquivos) -> dict:
+        """
+        Base não programada + cubo dos Gráficos 2–5 dos arquivos enviados (todas as abas dos
+        Excel, juntas numa base só), montados uma vez por conteúdo (`chave` = hash dos
+        arquivos) e compartilhados por todas as sessões:
+        cache_resource devolve a mesma instância, sem cópia nem unpickle por sessão.
+        Somente leitura — cada sessão materializa apenas o seu recorte filtrado.
+        A classificação por regras (Gráfico 1, 7 e triagem) fica em `classificar_base`.
+        """
+        pipeline.registrar_execucao("st_base_compartilhada")
+        if em_blocos:
+            df, n_planejadas, cols = pipeline.carregar_dados_em_blocos(_arquivos[0])
+            origem = []
+        else:
+            # cada arquivo/aba vem do próprio cache; só os novos são lidos (em paralelo)
+            df, n_planejadas, cols, origem = pipeline.carregar_nao_programadas_varios(_arquivos)
+        return {
+            "df": df, "n_planejadas": n_planejadas, "cols": cols, "origem": origem,
+            "cubo": pipeline.montar_cubo(df),
+        }
+
+    @medir_cache("st_base_incremental")
+    @st.cache_resource(show_spinner=False, max_entries=4)
+    def base_incremental(arquivo, nome_base: str, ml_backend: str) -> dict:
+        """Export acumulado: só o delta em relação ao último carregamento de `nome_base` é processado."""
+        pipeline.registrar_execucao("st_base_incremental")
+        return pipeline.carregar_incremental(arquivo, nome_base, ml_backend=ml_backend)
+
+    # =========================
+    # Execução em segundo plano (classificação e ML sem travar os demais gráficos)
+    # =========================
+    SEGUNDO_PLANO = os.environ.get("DASH_SEGUNDO_PLANO", "1") == "1"
+    TRABALHOS_MAX = 16  # resultados guardados (por base e por recorte)
+
+    @st.cache_resource(show_spinner=False)
+    def executor_segundo_plano() -> dict:
+        """Pool de threads + trabalhos por chave, compartilhados entre sessões e reruns."""
+        return {
+            "pool": ThreadPoolExecutor(max_workers=2, thread_name_prefix="dash-trabalho"),
+            "trabalhos": OrderedDict(),
+            "trava": threading.Lock(),
+        }
+
+    def em_segundo_plano(chave: tuple, fn, *args) -> dict:
+        """
+        Agenda fn(progresso, *args) uma única vez por `chave` e devolve o trabalho
+        ({"futuro", "progresso", ...}); reruns e outras sessões com a mesma chave reaproveitam
+        o resultado. Trabalhos que falharam são reagendados no próximo pedido.
+        """
+        ex = executor_segundo_plano()
+        with ex["trava"]:
+            trab = ex["trabalhos"].get(chave)
+            if trab is None or (trab["futuro"].done() and trab["futuro"].exception() is not None):
+                trab = {"id": uuid.uuid4().hex, "nome": f"segundo_plano_{chave[0]}",
+                        "progresso": {"frac": 0.0, "texto": "na fila"}}
+                trab["futuro"] = ex["pool"].submit(_executar_medido, trab, fn, *args)
+                ex["trabalhos"][chave] = trab
+            ex["trabalhos"].move_to_end(chave)
+            concluidos = [k for k, t in ex["trabalhos"].items() if t["futuro"].done()]
+            for k in concluidos[:max(0, len(ex["trabalhos"]) - TRABALHOS_MAX)]:
+                del ex["trabalhos"][k]
+        return trab
+
+    def _executar_medido(trab: dict, fn, *args):
+        """
+        Corpo do trabalho no pool. A medição do pipeline é por thread, então as etapas
+        (classificação, ML, caches) são medidas aqui e guardadas no trabalho; cada sessão
+        as incorpora ao seu painel de desempenho ao usar o resultado (`medir_trabalho`).
+        """
+        pipeline.iniciar_medicao()
+        t0 = time.perf_counter()
         try:
-            df = pd.read_csv(arquivo, encoding="latin1", sep=";")
-        except Exception:
-            if hasattr(arquivo, "seek"):
-                arquivo.seek(0)
-            df = pd.read_csv(arquivo, engine="python", sep=None)
-
-    df.columns = df.columns.str.strip()
-
-    # Descrição normalizada
-    df["DE_SERVICO"] = df.get("DE_SERVICO", "").fillna("").astype(str)
-    df["DE_SERVICO_N"] = df["DE_SERVICO"].map(norm_txt)
-
-    # Datas
-    for col in ["ENTRADA", "SAIDA"]:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], dayfirst=True, errors="coerce")
-
-    # Ano/Mês
-    df["Ano/Mes"] = df["ENTRADA"].dt.to_period("M").dt.to_timestamp() if "ENTRADA" in df.columns else pd.NaT
-
-    # Semana ISO (ano-semana) a partir de ENTRADA
-    if "ENTRADA" in df.columns:
-        iso = df["ENTRADA"].dt.isocalendar()  # year, week, day
-        df["ISO_ANO"] = iso["year"].astype("Int64")
-        df["ISO_SEMANA"] = iso["week"].astype("Int64")
-        df["ANO_SEMANA"] = df["ISO_ANO"].astype(str) + "-S" + df["ISO_SEMANA"].astype(str).str.zfill(2)
-    else:
-        df["ISO_ANO"] = pd.NA
-        df["ISO_SEMANA"] = pd.NA
-        df["ANO_SEMANA"] = pd.NA
-
-    # Tempo de Permanência (h)
-    if {"ENTRADA", "SAIDA"}.issubset(df.columns):
-        tmp = (df["SAIDA"] - df["ENTRADA"]).dt.total_seconds() / 3600.0
-        df["Tempo de Permanência(h)"] = tmp.clip(lower=0)
-    else:
-        df["Tempo de Permanência(h)"] = pd.NA
-
-    # CD_EQUIPTO (sem ".0")
-    df["CD_EQUIPTO"] = (
-        df.get("CD_EQUIPTO", pd.NA)
-          .fillna("Não informado")
-          .astype(str).str.strip()
-          .str.replace(r"\.0$", "", regex=True)  # remove .0
-          .replace({"": "Não informado"})
-    )
-
-    # CD_CLASMANU
-    raw_clas = df.get("CD_CLASMANU", pd.NA).fillna("")
-    df["CD_CLASMANU"] = raw_clas.astype(str).str.strip().replace({"": "Não informado"})
-    df["CD_CLASMANU_CODE"] = df["CD_CLASMANU"].map(_to_int_code)
-    df["CD_CLASMANU_DESC"] = df["CD_CLASMANU_CODE"].map(CLASMANU_MAP).fillna(df["CD_CLASMANU"].astype(str))
-
-    return df
-
-# =========================
-# Filtro: remover planejadas (preventiva/primária)
-# =========================
-PLANNED_COLS_CANDIDATES = [
-    "CD_CLASMANU", "Tipo de manutenção", "TIPO_MANUTENCAO",
-    "TP_MANU", "CLASSIFICACAO", "PLANO", "PLANO_MANUTENCAO", "TP_OS"
-]
-# Regex abrangente (considera descrição normalizada)
-PLANNED_REGEX = re.compile(
-    r"(preventiv|primar|preditiv|inspec|lubrif|planejad|programad|"
-    r"\bpm\d*\b|\bpm\b|\brevisao|"
-    r"execucao\s*plano|plano\s*de\s*manutencao|ordem\s*de\s*servico\s*programada)",
-    flags=re.IGNORECASE
-)
-
-def aplicar_filtro_nao_programadas(df: pd.DataFrame):
-    cols = [c for c in PLANNED_COLS_CANDIDATES if c in df.columns]
-
-    # texto vindo das colunas "de tipo" (se existirem) + SEMPRE a descrição normalizada
-    texto_desc = df.get("DE_SERVICO_N", "").fillna("")
-    if cols:
-        texto_cols = df[cols].astype(str).applymap(norm_txt).agg(" ".join, axis=1)
-        texto = (texto_cols.fillna("") + " " + texto_desc).str.strip()
-    else:
-        texto = texto_desc
-
-    mask_planned = texto.str.contains(PLANNED_REGEX, na=False)
-    df_np = df[~mask_planned].copy()
-    return df_np, mask_planned, cols
-
-# =========================
-# Classificador (regras + ML opcional) — usado no Gráfico 1
-# =========================
-def build_rules():
-    rules_patterns = {
-        # Não precisamos criar regras para os novos "vazamentos";
-        # a decisão acontece na classify_rules com prioridade.
-        "Estrutural/Chassi": [
-            r"\bsolda(r|s|)\b|\bsoldar\b",
-            r"\bparafuso(s)?\b", r"\bsuporte(s)?\b", r"\bpino(s)?\b",
-            r"\bhaste(s)?\b", r"\bestirante(s)?\b",
-            r"\btrinca(d|s|)\b|\bquebr(ad|ou|a|ado)\b", r"\bchassi\b",
-        ],
-        "Corte/Facão & Plataforma": [
-            r"\bfac[aã]o\b", r"\bsincron", r"\bmancal\b",
-            r"\bdivisor( de linha)?\b", r"\bplataforma\b", r"\bbarra de corte\b"
-        ],
-        "Cabine/Carroceria": [r"\bparabris|vidro|retrovisor|escada|porta(s)?\b", r"\bcap[oô]\b", r"\bgrade\b"],
-        "Tanque/Combustível (sem vazamento)": [r"\btanque\b", r"\bcinta do tanque\b", r"\bboia do tanque\b"],
-        "Freio": [r"\bfreio(s)?\b", r"\bpastilh", r"\blona(s)?\b", r"\bdisco(s)?\b", r"\btambor(es)?\b", r"\bpin[cç]a\b", r"\bcilindro mestre\b", r"\bfluido de freio\b"],
-        "Suspensão": [r"\bamortecedor(es)?\b", r"\bmola(s)?\b", r"\bfeixe de mola\b", r"\bbucha(s)?\b", r"\bbandeja\b", r"\bpivo\b", r"\bestabilizador\b"],
-        "Direção": [r"\b(caixa|sistema) de dire[cç][aã]o\b", r"\bterminal de dire[cç][aã]o\b", r"\bbarra de dire[cç][aã]o\b", r"\borbitrol\b"],
-        "Elétrica": [r"\beletr[aí]c", r"\bchicote\b", r"\bfus[ií]vel\b", r"\brele\b", r"\bl[aâ]mpada|farol|lanterna\b", r"\bbateria\b", r"\bmotor de arranque\b", r"\balternador\b"],
-        "Falha Eletrônica / Painel": [r"\bpainel\b", r"\b(luz|lamp)\s*espia\b", r"\bc[oó]digo de falha\b", r"\b(sensor|atuador|modulo|ecu|can)\b", r"\bsem comunica[cç][aã]o\b", r"\binjet(or|or(es)?)\b"],
-        "Sistema Hidráulico (sem vazamento)": [r"\bbomba\b.*\bhidraul", r"\bvalvula\b.*\bhidraul", r"\bcilindro\b.*\bhidraul", r"\bhidromotor|hidrostat(ico|ica)\b"],
-        "Pneus/Rodagem": [r"\bpneu(s)?\b", r"\broda(s)?\b", r"\bc[aâ]mara\b", r"\bcalibr", r"\bfuro\b"],
-        "Rodantes": [r"\brodante(s)?\b", r"\brolete(s)?\b", r"\broda motriz\b", r"\bcoroa\b", r"\besteira|sapata\b"],
-        "Ar Condicionado": [r"\bar condicionado\b|\bac\b", r"\bcompressor\b.*\bar\b|\bcompressor do ar\b", r"\bcondensador\b", r"\bevaporador\b", r"\bventilador\b", r"\bgas do ar\b"],
-        "Transmissão / Câmbio": [r"\b(cambio|transmiss[aã]o)\b", r"\bembreagem\b", r"\b(diferencial|planet[aá]ria|coroa|pinhao)\b", r"\bcarda?n\b"],
-        "Motor": [r"\bmotor(?!ista)\b", r"\bcabecote\b", r"\bpist[aã]o\b", r"\bbiela\b", r"\bbronzina\b", r"\bbomba de oleo\b", r"\barrefe(c|ç)edor\b", r"\bturbina|turbo\b", r"\bcorreia dent"],
-        "Mangueira (Vazamento)": [r"\bmangueira(s)?\b", r"\bflex[ií]vel\b"],
-        # antigas categorias de vazamento (deixamos para mapear para as novas quando ocorrer)
-        "Vazamento - Óleo": [r"\bretentor\b", r"\bvedador(es)?\b"],
-        "Vazamento - Hidráulico": [r"\bcilindro hidraul", r"\bbomba hidraul"],
-        "Vazamento - Combustível": [r"\b(bomba|filtro)\s*(de)?\s*(combust|diesel)", r"\blinha\s*de\s*(combust|diesel)"],
-    }
-    return {cat: [re.compile(p) for p in pats] for cat, pats in rules_patterns.items()}
-
-_RULES = build_rules()
-
-def classify_rules(texto: str) -> str:
-    """Classificador por regras com prioridade para as 3 novas categorias de vazamento."""
-    t = norm_txt(texto)
-    if not t:
-        return "Não Classificado"
-
-    # sinais de vazamento/rompimento
-    has_leak = bool(re.search(r"\bvaz[a-z]*\b", t))
-    has_break = bool(re.search(r"\b(romp|fur(ad|o)|estour|trinc|rachad)\b", t))
-
-    # combustível (diesel/gasolina/etanol/combust…)
-    has_fuel = bool(re.search(r"\b(diesel|combust|gasol|etanol)\b", t))
-
-    # mangueira / flexível / crimpagem / engate rápido
-    has_hose = bool(re.search(r"\bmangueir|flexivel|crimp|engate\s*rapid", t))
-    has_hose_problem = has_hose and (has_leak or has_break)
-
-    # --- decisão das 3 categorias de vazamento ---
-    if has_hose_problem:
-        return LEAK_HOSE
-    if has_leak and has_fuel:
-        return LEAK_FUEL
-    if has_leak:
-        # todo vazamento que não for combustível/mangueira cai aqui (óleo em geral)
-        return LEAK_OIL
-
-    # --- demais regras (já existentes) ---
-    for categoria, pats in _RULES.items():
-        for pat in pats:
-            if pat.search(t):
-                # mapear categorias antigas para as novas quando aplicável
-                if categoria in ("Vazamento - Óleo", "Vazamento - Hidráulico"):
-                    return LEAK_OIL
-                if categoria == "Vazamento - Combustível":
-                    return LEAK_FUEL
-                if categoria == "Mangueira (Vazamento)":
-                    return LEAK_HOSE
-                return categoria
-
-    # fallback: menção clara a motor
-    if re.search(r"\bmotor(?!ista)\b", t):
-        return "Motor"
-
-    return "Não Classificado"
-
-def ml_reclass_optional(df_base: pd.DataFrame, col_txt: str, col_cat_in: str, threshold: float = 0.6):
-    """Reclassifica apenas 'Não Classificado' usando TF-IDF + Naive Bayes, se scikit-learn estiver disponível."""
-    try:
-        from sklearn.feature_extraction.text import TfidfVectorizer
-        from sklearn.naive_bayes import MultinomialNB
-        from sklearn.pipeline import Pipeline
-    except Exception:
-        return df_base[col_cat_in]
-
-    train = df_base[~df_base[col_cat_in].isin(["Não Classificado", "Avaliar"])].copy()
-    if train.empty or train[col_txt].str.len().sum() == 0:
-        return df_base[col_cat_in]
-
-    pipe = Pipeline([("tfidf", TfidfVectorizer(ngram_range=(1, 2), min_df=3)), ("clf", MultinomialNB())])
-    pipe.fit(train[col_txt], train[col_cat_in])
-
-    mask_nc = df_base[col_cat_in].eq("Não Classificado")
-    if mask_nc.sum() == 0:
-        return df_base[col_cat_in]
-
-    proba = pipe.predict_proba(df_base.loc[mask_nc, col_txt])
-    classes = pipe.classes_
-    top_idx = proba.argmax(axis=1)
-    top_prob = proba.max(axis=1)
-    pred = classes[top_idx]
-
-    out = df_base[col_cat_in].copy()
-    idx = df_base.loc[mask_nc].index
-    reassign = idx[top_prob >= threshold]
-    out.loc[reassign] = pred[top_prob >= threshold]
-    return out
-
-# =========================
-# Upload
-# =========================
-st.sidebar.header("Arquivo")
-arquivo = st.sidebar.file_uploader("Envie o arquivo (.csv, .xlsx, .xls)", type=["csv", "xlsx", "xls"])
-if arquivo is None:
-    st.info("Envie o arquivo no painel lateral para carregar o dashboard.")
-    st.stop()
-
-df_raw = carregar_dados(arquivo)
-
-# =========================
-# Remover planejadas
-# =========================
-df, mask_planned, cols_usadas = aplicar_filtro_nao_programadas(df_raw)
-st.sidebar.markdown(
-    f"**Planejadas removidas:** {int(mask_planned.sum())}  \n"
-    f"**Registros analisados (NÃO programadas):** {len(df)}  \n"
-    f"**Colunas usadas:** {', '.join(cols_usadas) if cols_usadas else 'Fallback por descrição'}"
-)
-
-# =========================
-# Filtros (por Semana do Ano - ISO e por classe)
-# =========================
-st.sidebar.header("Filtros")
-
-# filtro por classe (usa descrição no label, código no valor)
-codes_unique = sorted([c for c in df["CD_CLASMANU_CODE"].dropna().unique().tolist()])
-format_func = lambda c: CLASMANU_MAP.get(int(c), str(c))
-op_clas = st.sidebar.multiselect(
-    "Filtrar por CD_CLASMANU (opcional)",
-    options=codes_unique,
-    default=codes_unique,
-    format_func=format_func
-)
-mask_clas = df["CD_CLASMANU_CODE"].isin(op_clas) if len(op_clas) > 0 else pd.Series(True, index=df.index)
+            return fn(trab["progresso"], *args)
+        finally:
+            trab["segundos"] = round(time.perf_counter() - t0, 4)
+            trab["medicao"] = pipeline.finalizar_medicao()
+
+    def medir_trabalho(trab: dict):
+        """
+        Painel de desempenho: na primeira vez que a sessão usa o resultado entram as etapas
+        medidas no pool (e o tempo total do trabalho); nas seguintes, um acerto de cache.
+        """
+        if not pipeline.medindo() or "medicao" not in trab:
+            return
+        vistos = st.session_state.setdefault("_trabalhos_medidos", set())
+        if trab["id"] in vistos:
+            pipeline.contar_cache(trab["nome"], hits=1)
+            return
+        vistos.add(trab["id"])
+        pipeline.contar_cache(trab["nome"], misses=1)
+        pipeline.incorporar_medicao(trab["medicao"], segundo_plano=True)
+        pipeline.incorporar_medicao(
+            [{"etapa": trab["nome"], "tipo": "etapa", "segundos": trab["segundos"]}], segundo_plano=True
+        )
 
-# filtro por Semana do Ano (ISO)
-if "ISO_ANO" in df.columns and df["ISO_ANO"].notna().any():
-    anos_disp = sorted(df.loc[df["ISO_ANO"].notna(), "ISO_ANO"].unique().tolist())
-    ano_sel = st.sidebar.selectbox("Ano (ISO)", options=anos_disp, index=len(anos_disp)-1)
+    def concluido(valor) -> dict:
+        """Trabalho já resolvido (ex.: classificação vinda do estado incremental)."""
+        fut = Future()
+        fut.set_result(valor)
+        return {"futuro": fut, "progresso": {"frac": 1.0, "texto": "pronto"}}
+
+    def pronto(trab: dict, texto: str):
+        """
+        Resultado do trabalho, ou None enquanto roda: no lugar fica uma barra de progresso
+        (fragmento atualizado a cada segundo) que refaz a página quando o resultado chega.
+        Sem segundo plano (ou Streamlit sem st.fragment) espera o resultado aqui.
+        """
+        fut = trab["futuro"]
+        if not fut.done() and segundo_plano and hasattr(st, "fragment"):
+            @st.fragment(run_every=1.0)
+            def _progresso():
+                if fut.done():
+                    st.rerun()
+                p = trab["progresso"]
+                st.progress(min(max(float(p["frac"]), 0.0), 1.0), text=f"{texto}: {p['texto']}")
+            _progresso()
+            return None
+
+        if not fut.done():
+            with st.spinner(f"{texto}..."):
+                wait([fut])
+        resultado = fut.result()
+        medir_trabalho(trab)
+        return resultado
+
+    def classificar_base(progresso: dict, df: pd.DataFrame) -> pd.Series:
+        """Comp_Rules da base inteira (roda no pool; reaproveitado por todos os recortes)."""
+        def avancar(feitos, total):
+            progresso.update(frac=feitos / max(total, 1), texto=f"{feitos:,} de {total:,} descrições inéditas")
+        progresso["texto"] = "consultando o cache de classificação"
+        return pipeline.classify_rules_batch(df["DE_SERVICO_N"], progresso=avancar)
+
+    def calcular_recorte(progresso: dict, df: pd.DataFrame, comp_rules: pd.Series, ano, semanas: tuple, classes: tuple,
+                         use_ml: bool, ml_threshold: float, ml_base_completa: bool, ml_backend: str, modelo) -> dict:
+        """Gráfico 1 + triagem de um recorte (semanas/classe + ML); roda no pool."""
+        progresso.update(frac=0.1, texto="aplicando filtros")
+        with pipeline.etapa("filtros") as reg:
+            df_clf = df[mascara_filtro(df, ano, list(semanas), list(classes))].copy()
+            reg["linhas"] = len(df_clf)
+        df_clf["Comp_Rules"] = comp_rules.loc[df_clf.index]
+
+        df_treino_ml = None
+        if use_ml and ml_base_completa:
+            df_treino_ml = df[["DE_SERVICO_N"]].assign(Comp_Rules=comp_rules)
+        if use_ml:
+            progresso.update(frac=0.3, texto=f"reclassificando {len(df_clf):,} OS com ML")
+        df_clf["Componente Detectado (final)"] = componentes_finais(
+            df_clf, use_ml, ml_threshold, df_treino_ml, ml_backend, modelo=modelo
+        )
 
-    semanas_disp = sorted(
-        df.loc[(df["ISO_ANO"] == ano_sel) & df["ISO_SEMANA"].notna(), "ISO_SEMANA"].unique().tolist()
+        progresso.update(frac=0.9, texto="montando tabelas")
+        return {
+            "g4": tabela_componentes_linhas(df_clf["Componente Detectado (final)"]),
+            "antes_nc": int((df_clf["Comp_Rules"] == "Não Classificado").sum()),
+            "depois_nc": int((df_clf["Componente Detectado (final)"] == "Não Classificado").sum()),
+            "top_descricoes": tabela_nao_classificadas(df_clf),
+        }
+
+    # =========================
+    # Upload
+    # =========================
+    st.sidebar.header("Arquivo")
+    arquivos = st.sidebar.file_uploader(
+        "Envie os arquivos (.csv, .xlsx, .xls)", type=["csv", "xlsx", "xls"], accept_multiple_files=True,
+        help="Vários arquivos (ex.: um por mês) e todas as abas dos Excel viram uma base só."
     )
-    default_weeks = semanas_disp[-4:] if len(semanas_disp) >= 4 else semanas_disp
-
-    semanas_sel = st.sidebar.multiselect(
-        "Semana do Ano",
-        options=semanas_disp,
-        default=default_weeks,
-        help="Semana ISO de 1 a 53 (pode escolher várias)"
+    if not arquivos:
+        st.info("Envie o arquivo no painel lateral para carregar o dashboard.")
+        st.stop()
+
+    arquivo = arquivos[0]
+    nomes_arquivos = ", ".join(a.name for a in arquivos)
+    # incremental e leitura em blocos tratam um único export acumulado
+    um_arquivo = len(arquivos) == 1
+    eh_csv = um_arquivo and not pipeline.eh_excel(arquivo)
+    incremental = um_arquivo and st.sidebar.checkbox(
+        "Modo incremental (export acumulado)", value=False,
+        help="Guarda a base processada e, a cada novo envio, processa só as OS novas ou alteradas."
+    )
+    if incremental:
+        nome_base = st.sidebar.text_input("Nome da base incremental", value=arquivo.name.rsplit(".", 1)[0])
+    em_blocos = eh_csv and not incremental and st.sidebar.checkbox(
+        "Leitura em blocos (CSV grande)", value=False,
+        help="Lê o CSV em partes, só com as colunas usadas e tipos compactos, para limitar a memória."
+    )
+    ml_backend = st.sidebar.selectbox(
+        "Modelo do ML (beta)", ["tfidf", "hashing"],
+        index=1 if pipeline.ML_BACKEND == "hashing" else 0,
+        format_func=lambda b: {"tfidf": "TF-IDF", "hashing": "Hashing incremental (bases grandes)"}[b],
+        help="Hashing: memória limitada e, no modo incremental, treino só com as OS novas de cada envio."
+    )
+    segundo_plano = st.sidebar.toggle(
+        "Classificar em segundo plano", value=SEGUNDO_PLANO,
+        help="Mostra os gráficos que só dependem dos filtros enquanto a classificação e o ML rodam; "
+             "o Gráfico 1, o 7 e a triagem aparecem quando ficarem prontos."
     )
 
-    if len(semanas_sel) == 0:
-        mask_semana = pd.Series(False, index=df.index)
+    # =========================
+    # Remover planejadas (+ classificação por regras e cubo da base inteira)
+    # =========================
+    # chave do conteúdo: identifica a base nos caches compartilhados e memorizados
+    if um_arquivo:
+        chave_arquivo = pipeline.hash_conteudo(arquivo)
     else:
-        mask_semana = (df["ISO_ANO"].eq(ano_sel)) & (df["ISO_SEMANA"].isin(semanas_sel))
-else:
-    st.sidebar.info("Sem datas de ENTRADA para calcular semanas.")
-    mask_semana = pd.Series(True, index=df.index)
-
-# aplica filtros (apenas semana + classe)
-df_filtrado = df[mask_semana & mask_clas].copy()
-
-debug = st.sidebar.checkbox("Modo debug (mostrar heads)", value=False)
-
-# =========================
-# Gráfico 1 — Ocorrências por Componente (Classificação aprimorada)
-# =========================
-st.subheader("Gráfico 1 - Ocorrências por Componente — NÃO programadas (classificação aprimorada)")
-
-# 1) Regras
-df_clf = df_filtrado.copy()
-df_clf["Comp_Rules"] = df_clf["DE_SERVICO"].apply(classify_rules)
-
-# 2) (Opcional) ML leve para reclassificar parte do "Não Classificado"
-use_ml = st.sidebar.toggle("Auto-classificar Não Classificadas (beta)", value=True)
-ml_threshold = st.sidebar.slider("Confiança mínima (beta)", 0.50, 0.90, 0.60, 0.05)
-
-antes_nc = int((df_clf["Comp_Rules"] == "Não Classificado").sum())
-
-if use_ml:
-    df_clf["Componente Detectado (final)"] = ml_reclass_optional(
-        df_clf, "DE_SERVICO_N", "Comp_Rules", threshold=ml_threshold
+        # independe da ordem de envio; repetir um arquivo não muda a base
+        chave_arquivo = hashlib.sha1(
+            ":".join(sorted({pipeline.hash_conteudo(a) for a in arquivos})).encode()
+        ).hexdigest()
+    if incremental:
+        chave_base = f"{chave_arquivo}:incremental:{nome_base}"
+        inc = base_incremental(arquivo, nome_base, ml_backend)
+        df, n_planejadas, cols_usadas = inc["df"], inc["n_planejadas"], inc["cols"]
+        cubo_info, g6 = inc["cubo"], inc["mensal"]
+        trab_regras = concluido(inc["comp"])
+        # modelo hashing atualizado com o delta (treinado na base acumulada inteira)
+        ml_incremental = inc.get("ml")
+        st.sidebar.caption(
+            f"Incremental ({inc['stats']['chave']}): {inc['stats']['novas']} novas, "
+            f"{inc['stats']['alteradas']} alteradas, {inc['stats']['removidas']} removidas"
+        )
+    else:
+        base = base_compartilhada(chave_arquivo, em_blocos, arquivos)
+        df, n_planejadas, cols_usadas = base["df"], base["n_planejadas"], base["cols"]
+        cubo_info, g6 = base["cubo"], None
+        ml_incremental = None
+        chave_base = f"{chave_arquivo}:{'blocos' if em_blocos else 'completo'}"
+        # regras sobre a base inteira: no pool, enquanto os gráficos só de filtro são exibidos
+        trab_regras = em_segundo_plano(("regras", chave_base), classificar_base, df)
+        if len(base["origem"]) > 1:
+            with st.sidebar.expander(f"Base combinada: {len(base['origem'])} arquivos/abas", expanded=False):
+                st.dataframe(
+                    pd.DataFrame(base["origem"]).rename(columns={
+                        "origem": "Arquivo [aba]", "linhas": "Linhas", "cache": "Do cache"}),
+                    hide_index=True, use_container_width=True,
+                )
+    st.sidebar.markdown(
+        f"**Planejadas removidas:** {n_planejadas}  \n"
+        f"**Registros analisados (NÃO programadas):** {len(df)}  \n"
+        f"**Colunas usadas:** {', '.join(cols_usadas) if cols_usadas else 'Fallback por descrição'}"
     )
-else:
-    df_clf["Componente Detectado (final)"] = df_clf["Comp_Rules"]
 
-depois_nc = int((df_clf["Componente Detectado (final)"] == "Não Classificado").sum())
-
-g4 = (
-    df_clf["Componente Detectado (final)"].astype(str).replace({"": "Não Classificado"})
-      .value_counts(dropna=False).reset_index()
-)
-g4.columns = ["Componente", "Ocorrências"]
-g4["Ocorrências"] = pd.to_numeric(g4["Ocorrências"], errors="coerce").fillna(0)
+    # =========================
+    # Filtros (por Semana do Ano - ISO e por classe)
+    # =========================
+    st.sidebar.header("Filtros")
+
+    # filtro por classe (usa descrição no label, código no valor)
+    codes_unique = sorted([c for c in df["CD_CLASMANU_CODE"].dropna().unique().tolist()])
+    format_func = lambda c: CLASMANU_MAP.get(int(c), str(c))
+    op_clas = st.sidebar.multiselect(
+        "Filtrar por CD_CLASMANU (opcional)",
+        options=codes_unique,
+        default=codes_unique,
+        format_func=format_func
+    )
 
-# nome “bonito” só para exibir
-g4["Componente_Display"] = g4["Componente"].map(DISPLAY_RENAME).fillna(g4["Componente"])
+    # filtro por Semana do Ano (ISO)
+    if "ISO_ANO" in df.columns and df["ISO_ANO"].notna().any():
+        anos_disp = sorted(df.loc[df["ISO_ANO"].notna(), "ISO_ANO"].unique().tolist())
+        ano_sel = st.sidebar.selectbox("Ano (ISO)", options=anos_disp, index=len(anos_disp)-1)
 
-# manter a ordenação por quantidade, mas usando o nome de exibição no eixo
-ordem_original = g4.sort_values("Ocorrências", ascending=False)["Componente"].tolist()
-ordem_display = [DISPLAY_RENAME.get(c, c) for c in ordem_original]
+        semanas_disp = semanas_disponiveis(df, ano_sel)
+        default_weeks = semanas_disp[-4:] if len(semanas_disp) >= 4 else semanas_disp
 
-if g4.empty:
-    st.info("Sem ocorrências por componente no período/seleção.")
-else:
-    st.caption(
-        f"‘Não Classificado’: {antes_nc} → {depois_nc}  |  ML={'on' if use_ml else 'off'}  |  conf. ≥ {ml_threshold:.2f}"
-    )
-    chart_g4 = (
-        alt.Chart(g4)
-        .mark_bar(color=COLOR)
-        .encode(
-            y=alt.Y(
-                "Componente_Display:N",
-                sort=ordem_display,
-                title="Componente",
-                axis=alt.Axis(labelLimit=2000)  # evita “…” nas labels
-            ),
-            x=alt.X("Ocorrências:Q", title="Ocorrências"),
-            tooltip=[
-                alt.Tooltip("Componente_Display:N", title="Componente"),
-                alt.Tooltip("Componente:N", title="Nome original"),
-                alt.Tooltip("Ocorrências:Q", title="Ocorrências"),
-            ],
+        semanas_sel = st.sidebar.multiselect(
+            "Semana do Ano",
+            options=semanas_disp,
+            default=default_weeks,
+            help="Semana ISO de 1 a 53 (pode escolher várias)"
         )
-        .properties(width=800, height=380)
-    )
-    st.altair_chart(chart_g4, use_container_width=True)
 
-# =========================
-# Gráfico 2 — Top 10 - Classe de Manutenção
-# =========================
-st.subheader("Gráfico 2 - Top 10 - Classe de Manutenção")
-if "CD_CLASMANU_DESC" in df_filtrado.columns:
-    g1 = (
-        df_filtrado["CD_CLASMANU_DESC"]
-        .astype(str)
-        .replace({"": "Não informado"})
-        .value_counts(dropna=False)
-        .reset_index()
-        .head(10)
-    )
-    g1.columns = ["Descricao", "Quantidade"]
-    g1["Quantidade"] = pd.to_numeric(g1["Quantidade"], errors="coerce").fillna(0)
-
-    if g1.empty:
-        st.info("Sem dados para CD_CLASMANU no período/seleção.")
+        filtro_ano = ano_sel
     else:
-        if debug: st.write("g1 head:", g1.head())
-        ordem = g1.sort_values("Quantidade", ascending=False)["Descricao"].tolist()
-        st.altair_chart(
-            alt.Chart(g1).mark_bar(color=COLOR).encode(
-                y=alt.Y("Descricao:N", sort=ordem, title="Classe de Manutenção"),
-                x=alt.X("Quantidade:Q", title="Quantidade"),
-                tooltip=["Descricao", "Quantidade"]
-            ).properties(width=800, height=380),
-            use_container_width=True
-        )
-else:
-    st.info("Coluna CD_CLASMANU não encontrada.")
+        st.sidebar.info("Sem datas de ENTRADA para calcular semanas.")
+        filtro_ano, semanas_sel = None, []
 
-# =========================
-# Gráfico 3 — Top 10 Número de OS por Equipamento
-# =========================
-st.subheader("Gráfico 3 - Top 10 Número de OS por Equipamento")
-g2 = (
-    df_filtrado["CD_EQUIPTO"]
-    .astype(str).str.replace(r"\.0$", "", regex=True)
-    .replace({"": "Não informado"})
-    .value_counts(dropna=False)
-    .reset_index(name="OS")
-    .rename(columns={"index": "CD_EQUIPTO"})
-    .head(10)
-)
-g2["OS"] = pd.to_numeric(g2["OS"], errors="coerce").fillna(0)
-
-if g2.empty:
-    st.info("Sem dados de equipamentos no período/seleção.")
-else:
-    if debug: st.write("g2 head:", g2.head())
-    ordem = g2.sort_values("OS", ascending=False)["CD_EQUIPTO"].tolist()
-    st.altair_chart(
-        alt.Chart(g2).mark_bar(color=COLOR).encode(
-            y=alt.Y("CD_EQUIPTO:N", sort=ordem, title="Equipamento"),
-            x=alt.X("OS:Q", title="Quantidade de OS"),
-            tooltip=[alt.Tooltip("CD_EQUIPTO:N", title="Equipamento"), "OS:Q"]
-        ).properties(width=800, height=380),
-        use_container_width=True
-    )
+    # Gráficos 2–5 saem do cubo pré-agregado (montado uma vez por arquivo)
+    sel_cubo = selecionar_cubo(cubo_info, filtro_ano, semanas_sel, op_clas)
 
-# =========================
-# Gráfico 4 — Top 10 Tempo Total de Permanência por Equipamento (h)
-# =========================
-st.subheader("Gráfico 4 - Top 10 Tempo Total de Permanência por Equipamento (h)")
-g3_base = df_filtrado.copy()
-g3_base["CD_EQUIPTO"] = g3_base["CD_EQUIPTO"].astype(str).str.replace(r"\.0$", "", regex=True)
-g3_base["Tempo de Permanência(h)"] = pd.to_numeric(g3_base["Tempo de Permanência(h)"], errors="coerce")
-
-g3 = (
-    g3_base.dropna(subset=["Tempo de Permanência(h)"])
-    .groupby("CD_EQUIPTO", as_index=False)["Tempo de Permanência(h)"].sum()
-    .sort_values("Tempo de Permanência(h)", ascending=False)
-    .head(10)
-)
+    debug = st.sidebar.checkbox("Modo debug (mostrar heads)", value=False)
 
-if g3.empty:
-    st.info("Sem dados de tempo de permanência no período/seleção.")
-else:
-    if debug: st.write("g3 head:", g3.head())
-    ordem = g3.sort_values("Tempo de Permanência(h)", ascending=False)["CD_EQUIPTO"].tolist()
-    st.altair_chart(
-        alt.Chart(g3).mark_bar(color=COLOR).encode(
-            y=alt.Y("CD_EQUIPTO:N", sort=ordem, title="Equipamento"),
-            x=alt.X("Tempo de Permanência(h):Q", title="Tempo (h)"),
-            tooltip=[
-                alt.Tooltip("CD_EQUIPTO:N", title="Equipamento"),
-                alt.Tooltip("Tempo de Permanência(h):Q", title="Tempo (h)", format=".2f")
-            ]
-        ).properties(width=800, height=380),
-        use_container_width=True
+    # ML leve para reclassificar parte do "Não Classificado" (Gráfico 1 e triagem)
+    use_ml = st.sidebar.toggle("Auto-classificar Não Classificadas (beta)", value=True)
+    ml_threshold = st.sidebar.slider("Confiança mínima (beta)", 0.50, 0.90, 0.60, 0.05)
+    ml_base_completa = st.sidebar.checkbox(
+        "Treinar ML com a base completa (beta)", value=False,
+        help="Treina uma vez sobre todas as OS não programadas em vez do recorte de semanas/classe."
     )
 
-# =========================
-# Gráfico 5 — Tendência diária (filtrado)
-# =========================
-st.subheader("Gráfico 5 - Tendência Diária de Entrada de OS")
-if "ENTRADA" in df_filtrado.columns:
-    tend = df_filtrado[df_filtrado["ENTRADA"].notna()].copy()
-    if tend.empty:
-        st.info("Sem dados de ENTRADA nas semanas selecionadas.")
-    else:
-        tend["Data de Entrada"] = tend["ENTRADA"].dt.floor("D")
-        g5 = tend.groupby("Data de Entrada").size().reset_index(name="Quantidade")
-        if debug: st.write("g5 head:", g5.head())
-        st.altair_chart(
-            alt.Chart(g5).mark_bar(color=COLOR).encode(
-                x=alt.X("Data de Entrada:T", title="Data", axis=alt.Axis(format="%d/%m")),
-                y=alt.Y("Quantidade:Q", title="OS por dia", scale=alt.Scale(domainMin=1)),
-                tooltip=[alt.Tooltip("Data de Entrada:T", title="Data"), alt.Tooltip("Quantidade:Q", title="Qtd")]
-            ).properties(width=800, height=380),
-            use_container_width=True
+    # =========================
+    # Seções sob demanda: cada gráfico só é calculado com a seção aberta
+    # =========================
+    def secao(titulo: str, chave: str, aberta: bool = False):
+        """
+        Expander com execução sob demanda: devolve (container, aberto).
+        Em versões do Streamlit sem `on_change` no expander a seção fica sempre ativa.
+        """
+        try:
+            exp = st.expander(titulo, expanded=aberta, key=f"secao_{chave}", on_change="rerun")
+        except TypeError:
+            return st.expander(titulo, expanded=aberta), True
+        return exp, exp.open is not False
+
+    @st.cache_resource(show_spinner=False, max_entries=4)
+    def serie_mensal(chave: str, _df: pd.DataFrame) -> pd.DataFrame:
+        """Gráfico 6 ignora os filtros: uma série por base (`chave`), compartilhada entre sessões."""
+        return tabela_mensal(_df)
+
+    @st.cache_resource(show_spinner=False, max_entries=8)
+    def eventos_falha(chave: str, por: str, _df: pd.DataFrame, _comp: pd.Series) -> pd.DataFrame:
+        """Eventos de parada (OS sobrepostas juntas) com TTR e TBF: uma vez por base (`chave`) e agrupamento."""
+        return pipeline.eventos_confiabilidade(_df, _comp, por)
+
+    @st.cache_data(show_spinner=False, max_entries=32)
+    def confiabilidade_recorte(chave: str, ano, semanas: tuple, classes: tuple, por: str, _ev: pd.DataFrame) -> pd.DataFrame:
+        """MTBF/MTTR/disponibilidade do recorte: uma vez por base + filtro (semanas, classes, agrupamento)."""
+        return tabela_confiabilidade(_ev[mascara_filtro(_ev, ano, list(semanas), list(classes))], por)
+
+    def resultado_recorte(texto: str):
+        """
+        Gráfico 1 + triagem do recorte atual, ou None enquanto calcula (com progresso).
+        Um trabalho por base + chave do filtro: abrir/fechar seções ou voltar a um filtro
+        já visto não refaz filtro nem ML.
+        """
+        comp_rules = pronto(trab_regras, "Classificando as descrições (regras)")
+        if comp_rules is None:
+            return None
+        chave = (chave_base, filtro_ano, tuple(semanas_sel), tuple(op_clas), use_ml, ml_threshold, ml_base_completa,
+                 ml_backend)
+        trab = em_segundo_plano(("recorte",) + chave, calcular_recorte, df, comp_rules, filtro_ano, tuple(semanas_sel),
+                                tuple(op_clas), use_ml, ml_threshold, ml_base_completa, ml_backend, ml_incremental)
+        return pronto(trab, texto)
+
+    # =========================
+    # Gráfico 1 — Ocorrências por Componente (Classificação aprimorada)
+    # =========================
+    sec, aberta = secao("Gráfico 1 - Ocorrências por Componente — NÃO programadas (classificação aprimorada)", "g1", aberta=True)
+    if aberta:
+        with sec:
+            rec = resultado_recorte("Gráfico 1")  # None: ainda calculando (progresso no lugar do gráfico)
+            if rec is not None and rec["g4"].empty:
+                st.info("Sem ocorrências por componente no período/seleção.")
+            elif rec is not None:
+                st.caption(
+                    f"‘Não Classificado’: {rec['antes_nc']} → {rec['depois_nc']}  |  "
+                    f"ML={'on' if use_ml else 'off'}  |  conf. ≥ {ml_threshold:.2f}"
+                )
+                mostrar_grafico("grafico1", grafico_componentes(rec["g4"]))
+
+    # =========================
+    # Gráfico 2 — Top 10 - Classe de Manutenção
+    # =========================
+    sec, aberta = secao("Gráfico 2 - Top 10 - Classe de Manutenção", "g2")
+    if aberta:
+        with sec:
+            if "CD_CLASMANU_DESC" in df.columns:
+                g1 = tabela_classes(sel_cubo)
+                g1["Quantidade"] = pd.to_numeric(g1["Quantidade"], errors="coerce").fillna(0)
+
+                if g1.empty:
+                    st.info("Sem dados para CD_CLASMANU no período/seleção.")
+                else:
+                    if debug: st.write("g1 head:", g1.head())
+                    mostrar_grafico("grafico2", grafico_classes(g1))
+            else:
+                st.info("Coluna CD_CLASMANU não encontrada.")
+
+    # =========================
+    # Gráfico 3 — Top 10 Número de OS por Equipamento
+    # =========================
+    sec, aberta = secao("Gráfico 3 - Top 10 Número de OS por Equipamento", "g3")
+    if aberta:
+        with sec:
+            g2 = tabela_os_equipamento(sel_cubo)
+            g2["OS"] = pd.to_numeric(g2["OS"], errors="coerce").fillna(0)
+
+            if g2.empty:
+                st.info("Sem dados de equipamentos no período/seleção.")
+            else:
+                if debug: st.write("g2 head:", g2.head())
+                mostrar_grafico("grafico3", grafico_os_equipamento(g2))
+
+    # =========================
+    # Gráfico 4 — Top 10 Tempo Total de Permanência por Equipamento (h)
+    # =========================
+    sec, aberta = secao("Gráfico 4 - Top 10 Tempo Total de Permanência por Equipamento (h)", "g4", aberta=True)
+    if aberta:
+        with sec:
+            g3 = tabela_horas_equipamento(sel_cubo)
+
+            if g3.empty:
+                st.info("Sem dados de tempo de permanência no período/seleção.")
+            else:
+                if debug: st.write("g3 head:", g3.head())
+                mostrar_grafico("grafico4", grafico_horas_equipamento(g3))
+
+    # =========================
+    # Gráfico 5 — Tendência diária (filtrado)
+    # =========================
+    sec, aberta = secao("Gráfico 5 - Tendência Diária de Entrada de OS", "g5")
+    if aberta:
+        with sec:
+            if "ENTRADA" in df.columns:
+                g5 = tabela_diaria(sel_cubo)
+                if g5.empty:
+                    st.info("Sem dados de ENTRADA nas semanas selecionadas.")
+                else:
+                    if debug: st.write("g5 head:", g5.head())
+                    res5 = st.radio("Resolução", ["auto", "dia", "semana", "mês"], horizontal=True, key="res_g5",
+                                    format_func=lambda r: "Automática" if r == "auto" else r.capitalize())
+                    g5, res5 = agrupar_serie(g5, "Data de Entrada", res5, base="dia")
+                    st.caption(f"Resolução: {res5} — {len(g5)} barras (limite {pipeline.MAX_MARCAS})")
+                    mostrar_grafico("grafico5", grafico_diario(g5, res5, ja_agrupada=True))
+            else:
+                st.info("Coluna ENTRADA não encontrada.")
+
+    # =========================
+    # Gráfico 6 — Tendência mensal (GERAL, sem filtro de período)
+    # =========================
+    sec, aberta = secao("Gráfico 6 - Tendência Mensal de Manutenções", "g6")
+    if aberta:
+        with sec:
+            if g6 is None:
+                g6 = serie_mensal(chave_base, df)
+            if debug: st.write("g6 head:", g6.head())
+            if g6.empty:
+                st.info("Não foi possível construir a série mensal (dados insuficientes).")
+            else:
+                res6 = st.radio("Resolução", ["auto", "mês", "trimestre", "ano"], horizontal=True, key="res_g6",
+                                format_func=lambda r: "Automática" if r == "auto" else r.capitalize())
+                g6_plot, res6 = agrupar_serie(g6, "Ano/Mes", res6, base="mês")
+                st.caption(f"Resolução: {res6} — {len(g6_plot)} pontos (limite {pipeline.MAX_MARCAS})")
+                mostrar_grafico("grafico6", grafico_mensal(g6_plot, res6, ja_agrupada=True))
+
+    # =========================
+    # Gráfico 7 — Confiabilidade (MTBF × MTTR por equipamento ou componente)
+    # =========================
+    sec, aberta = secao("Gráfico 7 - Confiabilidade: MTBF × MTTR", "g7")
+    if aberta:
+        with sec:
+            if "ENTRADA" not in df.columns:
+                st.info("Coluna ENTRADA não encontrada.")
+            else:
+                por = st.radio("Agrupar por", ["equipamento", "componente"], horizontal=True, key="por_g7",
+                               format_func=str.capitalize)
+                comp_rules = pronto(trab_regras, "Classificando as descrições (regras)")
+                g7 = None if comp_rules is None else confiabilidade_recorte(
+                    chave_base, filtro_ano, tuple(semanas_sel), tuple(op_clas), por, eventos_falha(chave_base, por, df, comp_rules)
+                )
+                if g7 is not None and g7.empty:
+                    st.info("Sem OS com ENTRADA e equipamento no período/seleção.")
+                elif g7 is not None:
+                    st.caption(
+                        "Falha = parada não programada; OS sobrepostas do mesmo equipamento contam como uma parada. "
+                        "TBF = início − fim da parada anterior (histórico completo); "
+                        "disponibilidade = MTBF / (MTBF + MTTR). "
+                        f"Gráfico: {min(len(g7), pipeline.MAX_MARCAS)} itens com mais horas paradas."
+                    )
+                    mostrar_grafico("grafico7", grafico_confiabilidade(g7, por))
+                    st.dataframe(g7.head(50), use_container_width=True)
+
+    # =========================
+    # Triagem — Não classificadas (para evoluir as regras)
+    # =========================
+    sec, aberta = secao("Amostras de descrições NÃO CLASSIFICADAS (para evolução das regras)", "triagem")
+    if aberta:
+        with sec:
+            rec = resultado_recorte("Triagem")
+            top_descricoes = None if rec is None else rec["top_descricoes"]
+            if top_descricoes is not None and top_descricoes.empty:
+                st.success("Nenhuma descrição não classificada no período/seleção.")
+            elif top_descricoes is not None:
+                st.dataframe(top_descricoes, use_container_width=True)
+                st.download_button(
+                    "Baixar CSV das não classificadas (top 50)",
+                    top_descricoes.to_csv(index=False).encode("utf-8-sig"),
+                    file_name="nao_classificadas_top50.csv",
+                    mime="text/csv"
+                )
+
+    # =========================
+    # Desempenho — etapas medidas nesta execução
+    # =========================
+    if medir:
+        registros = pipeline.finalizar_medicao()
+        jsonl = pipeline.gravar_medicao(registros, arquivo=nomes_arquivos, linhas_base=len(df))
+        painel_perf.dataframe(pd.DataFrame(registros), use_container_width=True)
+        painel_perf.download_button(
+            "Baixar medições (JSON lines)",
+            jsonl.encode("utf-8"),
+            file_name="medicoes_dashboard.jsonl",
+            mime="application/x-ndjson"
         )
-else:
-    st.info("Coluna ENTRADA não encontrada.")
-
-# =========================
-# Gráfico 6 — Tendência mensal (GERAL, sem filtro de período)
-# =========================
-st.subheader("Gráfico 6 - Tendência Mensal de Manutenções")
-g6 = df.dropna(subset=["Ano/Mes"]).groupby("Ano/Mes").size().reset_index(name="Quantidade")
-if debug: st.write("g6 head:", g6.head())
-if g6.empty:
-    st.info("Não foi possível construir a série mensal (dados insuficientes).")
-else:
-    st.altair_chart(
-        alt.Chart(g6).mark_line(point=True, color=COLOR).encode(
-            x=alt.X("Ano/Mes:T", title="Ano/Mês"),
-            y=alt.Y("Quantidade:Q", title="Quantidade de OS"),
-            tooltip=[alt.Tooltip("Ano/Mes:T", title="Ano/Mês"), alt.Tooltip("Quantidade:Q", title="Qtd")]
-        ).properties(width=800, height=380),
-        use_container_width=True
-    )
-
-# =========================
-# Triagem — Não classificadas (para evoluir as regras)
-# =========================
-st.subheader("Amostras de descrições NÃO CLASSIFICADAS (para evolução das regras)")
-nao_cls = df_clf[df_clf["Componente Detectado (final)"] == "Não Classificado"].copy()
-if nao_cls.empty:
-    st.success("Nenhuma descrição não classificada no período/seleção.")
-else:
-    top_descricoes = (
-        nao_cls["DE_SERVICO"]
-        .value_counts()
-        .reset_index(name="Ocorrências")
-        .rename(columns={"index": "Descrição"})
-        .head(50)
-    )
-    st.dataframe(top_descricoes, use_container_width=True)
-    st.download_button(
-        "Baixar CSV das não classificadas (top 50)",
-        top_descricoes.to_csv(index=False).encode("utf-8-sig"),
-        file_name="nao_classificadas_top50.csv",
-        mime="text/csv"
-    )
+finally:
+    if pipeline.medindo():
+        pipeline.finalizar_medicao()
@@ -0,0 +1,1975 @@
+"""
+Pipeline de análise das Ordens de Serviço (sem Streamlit).
+
+Carregamento, filtro de planejadas, classificação de componentes (regras + ML
+opcional) e agregações dos gráficos. Usado pelo `dashboard-completo.py` e pelo
+gerador de relatórios em lote (`relatorio_lote.py`).
+"""
+import pandas as pd
+import numpy as np
+import altair as alt
+import re, unicodedata
+import os, io, time, json, hashlib, sqlite3, pickle
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import functools, multiprocessing, threading, tracemalloc
+
+# cor padrão dos gráficos (verde)
+COLOR = "#2E7D32"
+
+# --- categorias novas de vazamento (nomes padronizados) ---
+LEAK_FUEL = "Vazamento – Combustível"
+LEAK_OIL  = "Vazamento – Óleo (geral)"
+LEAK_HOSE = "Vazamento – Mangueira"
+
+# nomes “bonitos” no gráfico de componentes
+DISPLAY_RENAME = {
+    LEAK_OIL:  "Vaz. Óleo (geral)",
+    LEAK_FUEL: "Vaz. Combustível",
+    LEAK_HOSE: "Vaz. Mangueira",
+
+    "Pneus/Rodagem": "Rodagem (Pneus)",
+    "Estrutural/Chassi": "Estrutural / Chassi",
+    "Corte/Facão & Plataforma": "Plataforma / Corte",
+    "Cabine/Carroceria": "Carroceria / Cabine",
+    "Falha Eletrônica / Painel": "Eletrônica / Painel",
+    "Ar Condicionado": "Ar Condicionado (AC)",
+    "Transmissão / Câmbio": "Transmissão / Câmbio",
+}
+
+# ====== Mapa de códigos -> descrição (CD_CLASMANU) ======
+CLASMANU_MAP = {
+    12: "CORRETIVA",
+    14: "PREVENTIVA SISTEMÁTICA",
+    15: "PREDITIVA",
+    16: "CENTRO DE CUSTO",
+    17: "PREVENTIVA CONDICIONAL",
+    18: "ENTRESSAFRA",
+    19: "MELHORIA/CAPEX",
+    20: "ENTRESSAFRA S/PLANO",
+    21: "SRS/MINI REFORMA",
+    23: "TECNOLOGIA AGRÍCOLA",
+    24: "GEOTECNOLOGIA",
+}
+
+def _to_int_code(x):
+    """Converte '12', '12.0', 12.0 etc para int 12; retorna None se não der."""
+    s = str(x).strip()
+    if not s or s.lower() == "nan":
+        return None
+    s = s.replace(",", ".")
+    try:
+        return int(float(s))
+    except:
+        m = re.search(r"\d+", s)
+        return int(m.group()) if m else None
+
+# =========================
+# Utils
+# =========================
+def norm_txt(s: str) -> str:
+    if not isinstance(s, str):
+        return ""
+    s = s.lower().strip()
+    s = unicodedata.normalize("NFKD", s).encode("ASCII", "ignore").decode("ASCII")
+    s = re.sub(r"[_\-.,;:/\\]+", " ", s)
+    s = re.sub(r"\s+", " ", s)
+    return s
+
+# tabela pré-calculada (Latin-1 + Latin Extended-A: todos os acentos do português) com a
+# mesma saída de NFKD + ASCII/ignore caractere a caractere; o que sobrar fora dela usa norm_txt
+_ACENTOS_ASCII = {
+    c: unicodedata.normalize("NFKD", chr(c)).encode("ASCII", "ignore").decode("ASCII")
+    for c in range(0x80, 0x180)
+}
+
+def norm_txt_serie(serie: pd.Series) -> pd.Series:
+    """
+    `norm_txt` de uma coluna inteira, com resultado idêntico elemento a elemento:
+    normaliza só os valores distintos, com operações vetorizadas de string (lower/strip,
+    tabela de acentos, regex) e cai no `norm_txt` exato para textos com caracteres fora da tabela.
+    """
+    codes, uniques = pd.factorize(serie, sort=False)
+    if len(uniques) == 0:
+        return pd.Series("", index=serie.index, dtype=object)
+    u = pd.Series(np.asarray(uniques, dtype=object))
+    u = u.where(u.map(type).eq(str), "")
+
+    txt = u.str.lower().str.strip().str.translate(_ACENTOS_ASCII)
+    fora = txt.str.contains(r"[^\x00-\x7f]", regex=True).to_numpy(bool)
+    txt = txt.str.replace(r"[_\-.,;:/\\]+", " ", regex=True).str.replace(r"\s+", " ", regex=True)
+    if fora.any():
+        txt[fora] = [norm_txt(x) for x in u[fora]]
+
+    out = txt.to_numpy(object).take(codes, mode="clip")
+    out[codes < 0] = ""
+    return pd.Series(out, index=serie.index, dtype=object)
+
+# =========================
+# Instrumentação (tempo, linhas, cache e memória por etapa)
+# =========================
+# arquivo JSON lines opcional onde cada execução medida é acrescentada
+PERF_LOG_PATH = os.environ.get("DASH_PERF_LOG", "")
+
+# uma medição por thread (cada sessão do Streamlit roda o script na sua thread)
+_PERF = threading.local()
+
+# o tracemalloc é do processo: só a thread que o ligou mede picos (reset_peak) e o desliga
+_TRACEMALLOC = {"dono": None}
+_TRACEMALLOC_LOCK = threading.Lock()
+
+def _assumir_tracemalloc() -> bool:
+    """Liga o tracemalloc para a thread atual; False se outra thread (ou o processo) já o usa."""
+    eu = threading.get_ident()
+    with _TRACEMALLOC_LOCK:
+        if _TRACEMALLOC["dono"] == eu:
+            return True
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start()
+        _TRACEMALLOC["dono"] = eu
+        return True
+
+def _liberar_tracemalloc():
+    with _TRACEMALLOC_LOCK:
+        if _TRACEMALLOC["dono"] == threading.get_ident():
+            tracemalloc.stop()
+            _TRACEMALLOC["dono"] = None
+
+def iniciar_medicao(memoria: bool = False):
+    """
+    Liga a coleta na thread atual; `memoria` ativa o tracemalloc (pico por etapa, mais
+    lento) — se outra thread já estiver medindo memória, esta mede só tempo e cache.
+    """
+    _PERF.registros = []
+    _PERF.caches = {}
+    _PERF.execucoes = {}
+    _PERF.pilha = []
+    if not memoria:
+        _liberar_tracemalloc()
+    _PERF.memoria = memoria and _assumir_tracemalloc()
+
+def finalizar_medicao() -> list:
+    """Desliga a coleta (e o tracemalloc, se foi esta thread que o ligou) e devolve os registros."""
+    registros = getattr(_PERF, "registros", None) or []
+    for nome, c in getattr(_PERF, "caches", {}).items():
+        registros.append({"etapa": nome, "tipo": "cache", **c})
+    _liberar_tracemalloc()
+    _PERF.registros = None
+    _PERF.memoria = False
+    return registros
+
+def medindo() -> bool:
+    return getattr(_PERF, "registros", None) is not None
+
+def contar_cache(nome: str, hits: int = 0, misses: int = 0, falhas: int = 0):
+    """Hits/misses de um cache; `falhas` = gravações que não foram feitas (o cache não vai servir)."""
+    if not medindo():
+        return
+    c = _PERF.caches.setdefault(nome, {"hits": 0, "misses": 0, "falhas": 0})
+    c["hits"] += int(hits)
+    c["misses"] += int(misses)
+    c["falhas"] += int(falhas)
+
+def incorporar_medicao(registros: list, **info):
+    """
+    Acrescenta à medição da thread atual registros medidos em outra thread (ex.: um
+    trabalho em segundo plano do dashboard); `info` vai em cada etapa incorporada.
+    """
+    if not medindo():
+        return
+    for r in registros:
+        if r.get("tipo") == "cache":
+            contar_cache(r["etapa"], hits=r["hits"], misses=r["misses"], falhas=r.get("falhas", 0))
+        else:
+            _PERF.registros.append({**r, **info})
+
+def registrar_execucao(nome: str):
+    """Chamado no corpo de funções com cache externo (ex.: st.cache_data): só roda em miss."""
+    if medindo():
+        _PERF.execucoes[nome] = _PERF.execucoes.get(nome, 0) + 1
+
+def execucoes(nome: str) -> int:
+    return _PERF.execucoes.get(nome, 0) if medindo() else 0
+
+@contextmanager
+def etapa(nome: str, **info):
+    """
+    Mede uma etapa: tempo de parede, pico de memória Python (se tracemalloc ligado)
+    e o que for posto no dict devolvido (ex.: reg["linhas"] = len(df)).
+    Sem medição ativa não faz nada.
+    """
+    if not medindo():
+        yield {}
+        return
+    reg = {"etapa": nome, "tipo": "etapa", **info}
+    mem = _PERF.memoria and tracemalloc.is_tracing()
+    if mem:
+        if _PERF.pilha:
+            pai = _PERF.pilha[-1]
+            pai["_pico"] = max(pai["_pico"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        reg["_pico"] = 0
+    _PERF.pilha.append(reg)
+    t0 = time.perf_counter()
+    try:
+        yield reg
+    finally:
+        reg["segundos"] = round(time.perf_counter() - t0, 4)
+        _PERF.pilha.pop()
+        if mem:
+            pico = max(reg.pop("_pico"), tracemalloc.get_traced_memory()[1])
+            reg["mem_pico_mb"] = round(pico / 2**20, 1)
+            if _PERF.pilha:
+                pai = _PERF.pilha[-1]
+                pai["_pico"] = max(pai["_pico"], pico)
+        _PERF.registros.append(reg)
+
+def _n_linhas(out):
+    if isinstance(out, (pd.DataFrame, pd.Series)):
+        return len(out)
+    if isinstance(out, tuple) and out and isinstance(out[0], (pd.DataFrame, pd.Series)):
+        return len(out[0])
+    if isinstance(out, dict) and isinstance(out.get("df"), pd.DataFrame):
+        return len(out["df"])
+    return None
+
+def medir_etapa(nome: str):
+    """Decorador: mede a função como etapa `nome` e registra as linhas do resultado."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not medindo():
+                return fn(*args, **kwargs)
+            with etapa(nome) as reg:
+                out = fn(*args, **kwargs)
+                reg["linhas"] = _n_linhas(out)
+            return out
+        return wrapper
+    return deco
+
+def gravar_medicao(registros: list, caminho: str = None, **contexto) -> str:
+    """Serializa os registros em JSON lines (com `contexto` em cada linha); acrescenta em `caminho` se houver."""
+    base = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "versao": f"{INGEST_VERSION}:{RULES_VERSION}", **contexto}
+    linhas = "".join(json.dumps({**base, **r}, ensure_ascii=False, default=str) + "\n" for r in registros)
+    caminho = PERF_LOG_PATH if caminho is None else caminho
+    if caminho:
+        try:
+            pasta = os.path.dirname(caminho)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+            with open(caminho, "a", encoding="utf-8") as f:
+                f.write(linhas)
+        except Exception:
+            pass
+    return linhas
+
+# =========================
+# Carregamento (CSV/Excel)
+# =========================
+INGEST_CACHE_DIR = os.environ.get("DASH_INGEST_CACHE", os.path.join(".cache", "ingest"))
+# uma entrada por arquivo CSV ou aba de Excel (bases de vários meses ocupam várias)
+INGEST_CACHE_MAX_FILES = int(os.environ.get("DASH_INGEST_CACHE_MAX", "60"))
+# esquema compacto: textos como dicionário (categóricas), inteiros pequenos em Int16,
+# horas em float32 e ANO_SEMANA só na exibição; DASH_COMPACT_SCHEMA=0 volta ao esquema antigo
+COMPACT_SCHEMA = os.environ.get("DASH_COMPACT_SCHEMA", "1") == "1"
+# subir quando a derivação de colunas mudar (invalida os arquivos já gravados)
+INGEST_VERSION = "5" + ("c" if COMPACT_SCHEMA else "")
+
+# colunas derivadas que viram categóricas (poucos valores distintos)
+CATEGORICAL_COLS = ["CD_EQUIPTO", "CD_CLASMANU", "CD_CLASMANU_DESC", "ANO_SEMANA"]
+# no esquema compacto as descrições também viram códigos numa tabela de descrições únicas
+TEXT_DICT_COLS = ["DE_SERVICO", "DE_SERVICO_N"]
+SMALL_INT_COLS = ["ISO_ANO", "ISO_SEMANA", "CD_CLASMANU_CODE"]
+
+def _conteudo_arquivo(arquivo) -> bytes:
+    """Bytes do upload (UploadedFile/BytesIO) ou do caminho em disco."""
+    if isinstance(arquivo, (str, os.PathLike)):
+        with open(arquivo, "rb") as f:
+            return f.read()
+    if hasattr(arquivo, "getvalue"):
+        return arquivo.getvalue()
+    pos = arquivo.tell() if hasattr(arquivo, "tell") else 0
+    dados = arquivo.read()
+    if hasattr(arquivo, "seek"):
+        arquivo.seek(pos)
+    return dados
+
+def hash_conteudo(arquivo) -> str:
+    return hashlib.sha1(_conteudo_arquivo(arquivo)).hexdigest()
+
+def eh_excel(arquivo, nome: str = None) -> bool:
+    nome = nome or getattr(arquivo, "name", arquivo if isinstance(arquivo, str) else "")
+    tipo = getattr(arquivo, "type", "")
+    return str(nome).lower().endswith((".xlsx", ".xls")) or "excel" in str(tipo).lower()
+
+def ler_arquivo(arquivo, planilha=0, nome: str = None) -> pd.DataFrame:
+    """Leitura bruta do CSV/Excel (sem colunas derivadas); `planilha` = nome ou posição da aba."""
+    # Excel?
+    if eh_excel(arquivo, nome):
+        return pd.read_excel(arquivo, sheet_name=planilha)
+
+    # CSV: tenta latin-1 e ';', depois autoinferência
+    try:
+        return pd.read_csv(arquivo, encoding="latin1", sep=";")
+    except Exception:
+        if hasattr(arquivo, "seek"):
+            arquivo.seek(0)
+        return pd.read_csv(arquivo, engine="python", sep=None)
+
+def ano_semana(df: pd.DataFrame) -> pd.Series:
+    """Rótulo 'AAAA-Snn' da semana ISO (no esquema compacto só é montado para exibição)."""
+    return df["ISO_ANO"].astype(str) + "-S" + df["ISO_SEMANA"].astype(str).str.zfill(2)
+
+def inteiro_compacto(serie: pd.Series) -> pd.Series:
+    """
+    Inteiro anulável mais estreito que comporta os valores: Int16 para ISO e os códigos
+    usuais, Int32/Int64 quando aparece um código grande (ex.: CD_CLASMANU 40012).
+    """
+    num = pd.to_numeric(serie, errors="coerce")
+    validos = num.dropna()
+    for tipo in ("int16", "int32"):
+        if validos.empty or (validos.min() >= np.iinfo(tipo).min and validos.max() <= np.iinfo(tipo).max):
+            return num.astype(tipo.capitalize())
+    return num.astype("Int64")
+
+def tipar_colunas(df: pd.DataFrame, compacto: bool = None) -> pd.DataFrame:
+    """
+    Tipos colunares: categóricas para códigos/descrições repetidas.
+
+    Esquema compacto (padrão, COMPACT_SCHEMA): descrições e demais colunas de texto
+    repetitivas como categóricas (códigos + tabela de valores únicos), ISO/código da
+    classe em Int16 (ou maior, ver `inteiro_compacto`), horas em float32 e sem a
+    coluna ANO_SEMANA (ver `ano_semana`).
+
+    Colunas do export com tipos misturados (ex.: OBS com números e texto no Excel)
+    viram texto, nulos mantidos: o Feather (cache/estado incremental) não as grava.
+    """
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ("string", "empty"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    compacto = COMPACT_SCHEMA if compacto is None else compacto
+    if not compacto:
+        df["ANO_SEMANA"] = ano_semana(df) if df["ISO_ANO"].notna().any() else pd.NA
+        for col in CATEGORICAL_COLS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        df["CD_CLASMANU_CODE"] = pd.to_numeric(df["CD_CLASMANU_CODE"], errors="coerce").astype("Int64")
+        return df
+
+    for col in SMALL_INT_COLS:
+        df[col] = inteiro_compacto(df[col])
+    df["Tempo de Permanência(h)"] = pd.to_numeric(df["Tempo de Permanência(h)"], errors="coerce").astype("float32")
+    # lista fixa (não depende dos dados): blocos e deltas do incremental saem com o mesmo esquema
+    for col in CATEGORICAL_COLS + TEXT_DICT_COLS + PLANNED_COLS_CANDIDATES:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+def _ingest_cache_path(chave: str) -> str:
+    return os.path.join(INGEST_CACHE_DIR, f"{chave}_v{INGEST_VERSION}.feather")
+
+def _ingest_cache_read(chave: str):
+    caminho = _ingest_cache_path(chave)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        import pyarrow.feather as feather
+        df = feather.read_table(caminho, memory_map=True).to_pandas()
+        os.utime(caminho)  # LRU pelo mtime
+        return df
+    except Exception:
+        return None
+
+def _ingest_cache_write(chave: str, df: pd.DataFrame):
+    """Grava a parte no cache; falha (disco, tipo que o pyarrow recusa) só deixa de cachear."""
+    try:
+        import pyarrow.feather as feather
+        os.makedirs(INGEST_CACHE_DIR, exist_ok=True)
+        caminho = _ingest_cache_path(chave)
+        tmp = caminho + ".tmp"
+        # sem compressão: permite leitura por memory-map
+        feather.write_feather(df, tmp, compression="uncompressed")
+        os.replace(tmp, caminho)
+
+        arquivos = sorted(
+            (os.path.join(INGEST_CACHE_DIR, f) for f in os.listdir(INGEST_CACHE_DIR) if f.endswith(".feather")),
+            key=os.path.getmtime,
+        )
+        for velho in arquivos[:-INGEST_CACHE_MAX_FILES]:
+            os.remove(velho)
+    except Exception:
+        pass
+
+# =========================
+# Vários arquivos / todas as planilhas (cada parte com cache próprio)
+# =========================
+# processos para ler as partes fora do cache (openpyxl e derivar_colunas seguram o GIL)
+INGEST_WORKERS = int(os.environ.get("DASH_INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# abas sem nenhuma destas colunas (resumos, tabelas dinâmicas) não são exports de OS
+_COLUNAS_OS = {"DE_SERVICO", "ENTRADA", "CD_EQUIPTO", "CD_CLASMANU"}
+
+def _reconciliar_colunas(raw: pd.DataFrame) -> pd.DataFrame:
+    """Nomes das colunas usadas como em USED_COLS, sem diferença de espaços/maiúsculas (exports/abas de origens diferentes)."""
+    nomes = {str(c).strip().upper(): c for c in raw.columns}
+    return raw.rename(columns={
+        nomes[c.upper()]: c for c in USED_COLS if c.upper() in nomes and nomes[c.upper()] != c
+    })
+
+def _eh_parte_de_os(raw: pd.DataFrame) -> bool:
+    return not raw.empty and bool(_COLUNAS_OS & {str(c).strip() for c in raw.columns})
+
+def ler_export(arquivo) -> pd.DataFrame:
+    """
+    Export bruto de um arquivo como base única (Excel: todas as abas de OS, sem os
+    resumos), com os nomes das colunas reconciliados: as mesmas linhas, na mesma
+    ordem, que carregar_varios lê do arquivo.
+    """
+    lido = ler_arquivo(arquivo, planilha=None)
+    abas = [_reconciliar_colunas(a) for a in (lido.values() if isinstance(lido, dict) else [lido])]
+    abas = [a for a in abas if _eh_parte_de_os(a)]
+    if not abas:
+        return pd.DataFrame(columns=USED_COLS[:5])
+    return abas[0] if len(abas) == 1 else pd.concat(abas, ignore_index=True)
+
+def _ler_parte(conteudo: bytes, nome: str, planilha, chave: str) -> pd.DataFrame:
+    """Lê uma parte (arquivo ou aba), deriva as colunas e grava o Feather; roda no processo filho."""
+    raw = _reconciliar_colunas(ler_arquivo(io.BytesIO(conteudo), planilha, nome=nome))
+    if not _eh_parte_de_os(raw):
+        raw = pd.DataFrame(columns=USED_COLS[:5])
+    df = derivar_colunas(raw)
+    _ingest_cache_write(chave, df)
+    return df
+
+def partes_arquivo(arquivo) -> list:
+    """
+    Partes de um upload/caminho: [(rótulo, chave do cache, planilha)]. CSV é uma parte
+    (chave = hash do conteúdo); Excel rende uma parte por aba (hash + posição da aba).
+    """
+    nome = str(getattr(arquivo, "name", arquivo if isinstance(arquivo, (str, os.PathLike)) else "arquivo"))
+    rotulo = os.path.basename(nome)
+    chave = hash_conteudo(arquivo)
+    if not eh_excel(arquivo):
+        return [(rotulo, chave, None)]
+    with pd.ExcelFile(io.BytesIO(_conteudo_arquivo(arquivo))) as xls:
+        abas = xls.sheet_names
+    return [(f"{rotulo} [{aba}]", f"{chave}_{i}", aba) for i, aba in enumerate(abas)]
+
+def _concat_partes(partes: list) -> pd.DataFrame:
+    """
+    Concatena partes com esquemas diferentes: colunas ausentes viram nulas (categóricas
+    onde outras partes as têm como categóricas) e as categorias são unificadas. Quando
+    o tipo das categorias diverge entre partes (ex.: coluna vazia lida como float num
+    arquivo e texto no outro) as categorias passam a object em todas.
+    """
+    colunas = list(dict.fromkeys(c for p in partes for c in p.columns))
+    cat_cols = {c for p in partes for c in p.columns if isinstance(p[c].dtype, pd.CategoricalDtype)}
+    alinhadas = []
+    for p in partes:
+        faltam = {
+            c: (pd.Categorical([None] * len(p), categories=pd.Index([], dtype=object)) if c in cat_cols
+                else pd.Series(pd.NA, index=p.index, dtype=object))
+            for c in colunas if c not in p.columns
+        }
+        if faltam:
+            p = p.assign(**faltam)
+        for col in cat_cols:
+            if not isinstance(p[col].dtype, pd.CategoricalDtype):
+                p[col] = p[col].astype("category")
+        alinhadas.append(p[colunas])
+    for col in cat_cols:
+        if len({str(p[col].cat.categories.dtype) for p in alinhadas}) > 1:
+            for p in alinhadas:
+                p[col] = p[col].cat.set_categories(p[col].cat.categories.astype(object))
+    return _concat_categoricas(alinhadas, ignore_index=True)
+
+@medir_etapa("carregar_varios")
+def carregar_varios(arquivos, workers: int = None):
+    """
+    Lê vários arquivos (e todas as abas dos Excel) como uma base só: cada parte fica no
+    cache Feather pelo próprio hash, então acrescentar um mês novo só lê aquele arquivo.
+    Partes fora do cache são lidas em paralelo (`workers` processos); arquivos repetidos
+    (mesmo conteúdo) entram uma vez. Retorna (df, [{"origem", "linhas", "cache"}]).
+    """
+    workers = INGEST_WORKERS if workers is None else workers
+    partes, vistas = [], set()
+    for arquivo in arquivos:
+        for rotulo, chave, planilha in partes_arquivo(arquivo):
+            if chave not in vistas:
+                vistas.add(chave)
+                partes.append((arquivo, rotulo, chave, planilha))
+
+    frames = [_ingest_cache_read(chave) for _, _, chave, _ in partes]
+    faltam = [i for i, f in enumerate(frames) if f is None]
+    contar_cache("ingestao_feather", hits=len(frames) - len(faltam), misses=len(faltam))
+    tarefas = {
+        i: (_conteudo_arquivo(partes[i][0]), str(getattr(partes[i][0], "name", partes[i][0])),
+            0 if partes[i][3] is None else partes[i][3], partes[i][2])
+        for i in faltam
+    }
+    if len(faltam) > 1 and workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(faltam)), mp_context=contexto_processos()) as pool:
+                futuros = {i: pool.submit(_ler_parte, *args) for i, args in tarefas.items()}
+                for i, fut in futuros.items():
+                    frames[i] = fut.result()
+        except Exception:
+            pass  # pool indisponível: o que faltou é lido em série abaixo
+    for i in faltam:
+        if frames[i] is None:
+            frames[i] = _ler_parte(*tarefas[i])
+    # a gravação pode ter sido num processo filho: confere pelo arquivo
+    contar_cache("ingestao_feather", falhas=sum(not os.path.exists(_ingest_cache_path(partes[i][2])) for i in faltam))
+
+    origem = [{"origem": rotulo, "linhas": len(f), "cache": i not in faltam}
+              for i, ((_, rotulo, _, _), f) in enumerate(zip(partes, frames))]
+    # abas descartadas (sem OS) não entram no concat: não impõem tipos às colunas das demais
+    cheios = [f for f in frames if len(f)] or frames[:1]
+    if len(cheios) == 1:
+        return cheios[0], origem
+    return _concat_partes(cheios), origem
+
+@medir_etapa("carregar_dados")
+def carregar_dados(arquivo):
+    """
+    Lê o arquivo e devolve o frame com todas as colunas derivadas (Excel: todas as abas).
+    O resultado fica gravado em Feather (pelo hash do conteúdo): reenviar o mesmo
+    export ou recarregar após reiniciar o servidor só lê o arquivo colunar.
+    """
+    return carregar_varios([arquivo])[0]
+
+# formatos testados (nesta ordem) numa amostra de cada coluna de data; datas do ERP são dia/mês
+DATE_FORMATS = [
+    "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y",
+    "%d/%m/%y %H:%M", "%d/%m/%y",
+    "%d-%m-%Y %H:%M", "%d-%m-%Y", "%d.%m.%Y %H:%M", "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "ISO8601",
+]
+_DATE_SAMPLE = 500
+_RE_SERIAL = r"^\d{1,7}(\.\d+)?$"
+# séries do Excel aceitas como data de OS: 03/10/1954 a 31/12/2099 — fora disso o número
+# (ex.: "2024", "1", um código perdido na coluna) não é data e vira NaT
+_SERIAL_MIN, _SERIAL_MAX = 20000, 73051
+
+def _serial_excel(valores: pd.Series) -> pd.Series:
+    """Número de série do Excel (dias desde 30/12/1899) -> datetime; fora de _SERIAL_MIN/_SERIAL_MAX vira NaT."""
+    v = pd.to_numeric(valores, errors="coerce")
+    v = v.where((v >= _SERIAL_MIN) & (v < _SERIAL_MAX))
+    return pd.to_datetime(v, unit="D", origin="1899-12-30")
+
+def _converter_tolerante(textos: pd.Series) -> pd.Series:
+    """Conversor antigo (dayfirst, elemento a elemento): só para o que o formato detectado não cobre."""
+    try:
+        return pd.to_datetime(textos, dayfirst=True, errors="coerce", format="mixed")
+    except (ValueError, TypeError):  # pandas < 2 já infere por elemento
+        return pd.to_datetime(textos, dayfirst=True, errors="coerce")
+
+def detectar_formato_data(textos: pd.Series):
+    """Formato de DATE_FORMATS que converte a maior parte de uma amostra de `textos` (None se nenhum)."""
+    if textos.empty:
+        return None
+    amostra = textos.iloc[::max(1, len(textos) // _DATE_SAMPLE)].str.strip()
+    amostra = amostra[~amostra.str.match(_RE_SERIAL)]
+    if amostra.empty:
+        return None
+    melhor, acertos = None, 0.0
+    for fmt in DATE_FORMATS:
+        try:
+            taxa = pd.to_datetime(amostra, format=fmt, errors="coerce").notna().mean()
+        except (ValueError, TypeError):  # ex.: "ISO8601" em pandas < 2
+            continue
+        if taxa > acertos:
+            melhor, acertos = fmt, taxa
+        if taxa == 1.0:
+            break
+    return melhor
+
+def converter_datas(serie: pd.Series):
+    """
+    Coluna de data -> datetime64, devolvendo (datas, info).
+
+    Converte só os valores distintos (o mesmo horário de entrada se repete muito):
+    datas já tipadas passam direto, números viram série do Excel e textos usam o
+    formato detectado numa amostra, de forma vetorizada. O que não casar com o
+    formato cai no conversor tolerante (dayfirst) e é contado em info["fallback"].
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie, {"formato": "datetime", "fallback": 0}
+    if pd.api.types.is_numeric_dtype(serie):
+        return _serial_excel(serie), {"formato": "serial Excel", "fallback": 0}
+
+    codes, uniques = pd.factorize(serie, sort=False)
+    if len(uniques) == 0:
+        # coluna toda vazia (ex.: SAIDA das OS ainda abertas no modo incremental)
+        return pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]"), {"formato": "tolerante", "fallback": 0}
+    u = pd.Series(np.asarray(uniques, dtype=object))
+    out = pd.Series(pd.NaT, index=u.index, dtype="datetime64[ns]")
+
+    if pd.api.types.infer_dtype(u, skipna=True) == "string":
+        txt = u
+    else:
+        # Excel com células mistas: datetimes já prontos passam direto
+        e_data = u.map(lambda x: isinstance(x, (pd.Timestamp, np.datetime64)) or hasattr(x, "isoformat"))
+        if e_data.any():
+            out[e_data] = pd.to_datetime(u[e_data], errors="coerce")
+        txt = u[~e_data].astype(str)
+    txt = txt[txt.ne("") & ~txt.isin(["nan", "NaN", "NaT", "None"])]
+
+    def pelo_formato(textos):
+        convertidas = pd.to_datetime(textos, format=formato, errors="coerce")
+        if getattr(convertidas.dt, "tz", None) is not None:
+            convertidas = convertidas.dt.tz_convert(None)
+        out[textos.index] = convertidas
+
+    formato = detectar_formato_data(txt)
+    if formato is not None:
+        pelo_formato(txt)
+
+    # o que o formato não cobriu: espaços nas pontas, número de série em texto (números fora da
+    # faixa de séries ficam NaT, sem passar pelo tolerante) ou conversor tolerante
+    resto = txt[out[txt.index].isna()].str.strip()
+    resto = resto[resto.ne("")]
+    if formato is not None and len(resto):
+        pelo_formato(resto)
+        resto = resto[out[resto.index].isna()]
+    e_serial = resto.str.match(_RE_SERIAL)
+    if e_serial.any():
+        out[resto.index[e_serial]] = _serial_excel(resto[e_serial])
+        resto = resto[~e_serial]
+    if len(resto):
+        out[resto.index] = _converter_tolerante(resto)
+
+    n_fallback = int(np.isin(codes, resto.index.to_numpy()).sum()) if len(resto) else 0
+    datas = pd.Series(out.to_numpy().take(codes, mode="clip"), index=serie.index)
+    datas[codes < 0] = pd.NaT
+    return datas, {"formato": formato or "tolerante", "fallback": n_fallback}
+
+def derivar_colunas(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.str.strip()
+
+    # Descrição normalizada
+    df["DE_SERVICO"] = df.get("DE_SERVICO", "").fillna("").astype(str)
+    df["DE_SERVICO_N"] = norm_txt_serie(df["DE_SERVICO"])
+
+    # Datas (formato detectado por coluna; ISO e permanência usam só o resultado tipado)
+    for col in ["ENTRADA", "SAIDA"]:
+        if col in df.columns:
+            with etapa("converter_datas", coluna=col) as reg:
+                df[col], info = converter_datas(df[col])
+                reg.update(info)
+
+    # Ano/Mês
+    df["Ano/Mes"] = df["ENTRADA"].dt.to_period("M").dt.to_timestamp() if "ENTRADA" in df.columns else pd.NaT
+
+    # Semana ISO (ano-semana) a partir de ENTRADA
+    if "ENTRADA" in df.columns:
+        iso = df["ENTRADA"].dt.isocalendar()  # year, week, day
+        df["ISO_ANO"] = iso["year"].astype("Int64")
+        df["ISO_SEMANA"] = iso["week"].astype("Int64")
+    else:
+        df["ISO_ANO"] = pd.NA
+        df["ISO_SEMANA"] = pd.NA
+
+    # Tempo de Permanência (h)
+    if {"ENTRADA", "SAIDA"}.issubset(df.columns):
+        tmp = (df["SAIDA"] - df["ENTRADA"]).dt.total_seconds() / 3600.0
+        df["Tempo de Permanência(h)"] = tmp.clip(lower=0)
+    else:
+        df["Tempo de Permanência(h)"] = pd.NA
+
+    # CD_EQUIPTO (sem ".0")
+    df["CD_EQUIPTO"] = (
+        df.get("CD_EQUIPTO", pd.NA)
+          .fillna("Não informado")
+          .astype(str).str.strip()
+          .str.replace(r"\.0$", "", regex=True)  # remove .0
+          .replace({"": "Não informado"})
+    )
+
+    # CD_CLASMANU
+    raw_clas = df.get("CD_CLASMANU", pd.NA).fillna("")
+    df["CD_CLASMANU"] = raw_clas.astype(str).str.strip().replace({"": "Não informado"})
+    df["CD_CLASMANU_CODE"] = df["CD_CLASMANU"].map(_to_int_code)
+    df["CD_CLASMANU_DESC"] = df["CD_CLASMANU_CODE"].map(CLASMANU_MAP).fillna(df["CD_CLASMANU"].astype(str))
+
+    return tipar_colunas(df)
+
+# =========================
+# Filtro: remover planejadas (preventiva/primária)
+# =========================
+PLANNED_COLS_CANDIDATES = [
+    "CD_CLASMANU", "Tipo de manutenção", "TIPO_MANUTENCAO",
+    "TP_MANU", "CLASSIFICACAO", "PLANO", "PLANO_MANUTENCAO", "TP_OS"
+]
+# Regex abrangente (considera descrição normalizada)
+PLANNED_REGEX = re.compile(
+    r"(preventiv|primar|preditiv|inspec|lubrif|planejad|programad|"
+    r"\bpm\d*\b|\bpm\b|\brevisao|"
+    r"execucao\s*plano|plano\s*de\s*manutencao|ordem\s*de\s*servico\s*programada)",
+    flags=re.IGNORECASE
+)
+
+def _mask_regex_por_valor(serie: pd.Series, regex, normalizar: bool = True) -> np.ndarray:
+    """Avalia `regex` uma vez por valor distinto da coluna e espalha o resultado pelas linhas."""
+    codes, uniques = pd.factorize(serie, sort=False)
+    if normalizar:
+        textos = norm_txt_serie(pd.Series([str(u) for u in uniques], dtype=object))
+        hits = np.array([bool(regex.search(t)) for t in textos], dtype=bool)
+    else:
+        hits = np.array([bool(regex.search(u)) if isinstance(u, str) else False for u in uniques], dtype=bool)
+    # NaN (código -1) vira "nan" no texto antigo, que nunca casa com o regex
+    return np.where(codes >= 0, hits.take(codes, mode="clip") if len(hits) else False, False)
+
+@medir_etapa("filtro_planejadas")
+def aplicar_filtro_nao_programadas(df: pd.DataFrame):
+    cols = [c for c in PLANNED_COLS_CANDIDATES if c in df.columns]
+
+    # colunas "de tipo" (se existirem) + SEMPRE a descrição normalizada;
+    # cada coluna é avaliada à parte (poucos valores distintos) e as máscaras somadas por OR
+    mask = np.zeros(len(df), dtype=bool)
+    for col in cols:
+        mask |= _mask_regex_por_valor(df[col], PLANNED_REGEX)
+    if "DE_SERVICO_N" in df.columns:
+        mask |= _mask_regex_por_valor(df["DE_SERVICO_N"], PLANNED_REGEX, normalizar=False)
+
+    mask_planned = pd.Series(mask, index=df.index)
+    df_np = df[~mask_planned].copy()
+    return df_np, mask_planned, cols
+
+def carregar_nao_programadas(arquivo):
+    """carregar_dados + filtro de planejadas: (df_nao_programadas, qtd_planejadas, colunas_usadas)."""
+    df_np, mask_planned, cols = aplicar_filtro_nao_programadas(carregar_dados(arquivo))
+    return df_np, int(mask_planned.sum()), cols
+
+def carregar_nao_programadas_varios(arquivos, workers: int = None):
+    """carregar_varios + filtro de planejadas: (df_nao_programadas, qtd_planejadas, colunas_usadas, origem)."""
+    df, origem = carregar_varios(arquivos, workers)
+    df_np, mask_planned, cols = aplicar_filtro_nao_programadas(df)
+    return df_np, int(mask_planned.sum()), cols, origem
+
+# =========================
+# Carregamento em blocos (CSV grande, memória limitada)
+# =========================
+CHUNK_ROWS = int(os.environ.get("DASH_CHUNK_ROWS", "200000"))
+
+# únicas colunas brutas que o dashboard usa
+USED_COLS = ["CD_EQUIPTO", "CD_CLASMANU", "DE_SERVICO", "ENTRADA", "SAIDA"] + PLANNED_COLS_CANDIDATES
+
+def _blocos_csv(arquivo, chunksize: int):
+    """
+    Iterador de blocos: latin-1 e ';' e, se falhar, autoinferência (mesma ordem de carregar_dados).
+    Colunas de USED_COLS sem diferença de espaços/maiúsculas, como em `_reconciliar_colunas`.
+    """
+    usadas = {c.upper() for c in USED_COLS}
+    usecols = lambda c: str(c).strip().upper() in usadas
+    try:
+        leitor = pd.read_csv(arquivo, encoding="latin1", sep=";", usecols=usecols, chunksize=chunksize)
+        primeiro = next(leitor)
+    except StopIteration:
+        return
+    except Exception:
+        if hasattr(arquivo, "seek"):
+            arquivo.seek(0)
+        leitor = pd.read_csv(arquivo, engine="python", sep=None, usecols=usecols, chunksize=chunksize)
+        primeiro = next(leitor, None)
+        if primeiro is None:
+            return
+    yield primeiro
+    yield from leitor
+
+def _concat_categoricas(blocos, ignore_index: bool = False) -> pd.DataFrame:
+    """Concatena blocos mantendo as categóricas (categorias unificadas antes do concat)."""
+    cat_cols = [c for c in blocos[0].columns if isinstance(blocos[0][c].dtype, pd.CategoricalDtype)]
+    for col in cat_cols:
+        cats = pd.api.types.union_categoricals([b[col] for b in blocos]).categories
+        for b in blocos:
+            b[col] = b[col].cat.set_categories(cats)
+    return pd.concat(blocos, ignore_index=ignore_index)
+
+@medir_etapa("carregar_em_blocos")
+def carregar_dados_em_blocos(arquivo, chunksize: int = CHUNK_ROWS):
+    """
+    Versão em blocos de carregar_dados + aplicar_filtro_nao_programadas para CSV:
+    lê só USED_COLS, deriva colunas, remove planejadas bloco a bloco (tipos de `tipar_colunas`),
+    de modo que o pico de memória acompanha o tamanho do bloco, não do arquivo.
+
+    Retorna (df_nao_programadas, qtd_planejadas_removidas, colunas_usadas).
+    """
+    if hasattr(arquivo, "seek"):
+        arquivo.seek(0)
+    blocos, n_planejadas, cols = [], 0, []
+    for bloco in _blocos_csv(arquivo, chunksize):
+        bloco = derivar_colunas(_reconciliar_colunas(bloco))
+        bloco_np, mask_planned, cols = aplicar_filtro_nao_programadas(bloco)
+        n_planejadas += int(mask_planned.sum())
+        blocos.append(bloco_np)
+        del bloco, mask_planned
+    if not blocos:
+        return derivar_colunas(pd.DataFrame(columns=USED_COLS[:5])), 0, []
+    return _concat_categoricas(blocos), n_planejadas, cols
+
+# =========================
+# Classificador (regras + ML opcional) — usado no Gráfico 1
+# =========================
+def build_rules():
+    rules_patterns = {
+        # Não precisamos criar regras para os novos "vazamentos";
+        # a decisão acontece na classify_rules com prioridade.
+        "Estrutural/Chassi": [
+            r"\bsolda(r|s|)\b|\bsoldar\b",
+            r"\bparafuso(s)?\b", r"\bsuporte(s)?\b", r"\bpino(s)?\b",
+            r"\bhaste(s)?\b", r"\bestirante(s)?\b",
+            r"\btrinca(d|s|)\b|\bquebr(ad|ou|a|ado)\b", r"\bchassi\b",
+        ],
+        "Corte/Facão & Plataforma": [
+            r"\bfac[aã]o\b", r"\bsincron", r"\bmancal\b",
+            r"\bdivisor( de linha)?\b", r"\bplataforma\b", r"\bbarra de corte\b"
+        ],
+        "Cabine/Carroceria": [r"\bparabris|vidro|retrovisor|escada|porta(s)?\b", r"\bcap[oô]\b", r"\bgrade\b"],
+        "Tanque/Combustível (sem vazamento)": [r"\btanque\b", r"\bcinta do tanque\b", r"\bboia do tanque\b"],
+        "Freio": [r"\bfreio(s)?\b", r"\bpastilh", r"\blona(s)?\b", r"\bdisco(s)?\b", r"\btambor(es)?\b", r"\bpin[cç]a\b", r"\bcilindro mestre\b", r"\bfluido de freio\b"],
+        "Suspensão": [r"\bamortecedor(es)?\b", r"\bmola(s)?\b", r"\bfeixe de mola\b", r"\bbucha(s)?\b", r"\bbandeja\b", r"\bpivo\b", r"\bestabilizador\b"],
+        "Direção": [r"\b(caixa|sistema) de dire[cç][aã]o\b", r"\bterminal de dire[cç][aã]o\b", r"\bbarra de dire[cç][aã]o\b", r"\borbitrol\b"],
+        "Elétrica": [r"\beletr[aí]c", r"\bchicote\b", r"\bfus[ií]vel\b", r"\brele\b", r"\bl[aâ]mpada|farol|lanterna\b", r"\bbateria\b", r"\bmotor de arranque\b", r"\balternador\b"],
+        "Falha Eletrônica / Painel": [r"\bpainel\b", r"\b(luz|lamp)\s*espia\b", r"\bc[oó]digo de falha\b", r"\b(sensor|atuador|modulo|ecu|can)\b", r"\bsem comunica[cç][aã]o\b", r"\binjet(or|or(es)?)\b"],
+        "Sistema Hidráulico (sem vazamento)": [r"\bbomba\b.*\bhidraul", r"\bvalvula\b.*\bhidraul", r"\bcilindro\b.*\bhidraul", r"\bhidromotor|hidrostat(ico|ica)\b"],
+        "Pneus/Rodagem": [r"\bpneu(s)?\b", r"\broda(s)?\b", r"\bc[aâ]mara\b", r"\bcalibr", r"\bfuro\b"],
+        "Rodantes": [r"\brodante(s)?\b", r"\brolete(s)?\b", r"\broda motriz\b", r"\bcoroa\b", r"\besteira|sapata\b"],
+        "Ar Condicionado": [r"\bar condicionado\b|\bac\b", r"\bcompressor\b.*\bar\b|\bcompressor do ar\b", r"\bcondensador\b", r"\bevaporador\b", r"\bventilador\b", r"\bgas do ar\b"],
+        "Transmissão / Câmbio": [r"\b(cambio|transmiss[aã]o)\b", r"\bembreagem\b", r"\b(diferencial|planet[aá]ria|coroa|pinhao)\b", r"\bcarda?n\b"],
+        "Motor": [r"\bmotor(?!ista)\b", r"\bcabecote\b", r"\bpist[aã]o\b", r"\bbiela\b", r"\bbronzina\b", r"\bbomba de oleo\b", r"\barrefe(c|ç)edor\b", r"\bturbina|turbo\b", r"\bcorreia dent"],
+        "Mangueira (Vazamento)": [r"\bmangueira(s)?\b", r"\bflex[ií]vel\b"],
+        # antigas categorias de vazamento (deixamos para mapear para as novas quando ocorrer)
+        "Vazamento - Óleo": [r"\bretentor\b", r"\bvedador(es)?\b"],
+        "Vazamento - Hidráulico": [r"\bcilindro hidraul", r"\bbomba hidraul"],
+        "Vazamento - Combustível": [r"\b(bomba|filtro)\s*(de)?\s*(combust|diesel)", r"\blinha\s*de\s*(combust|diesel)"],
+    }
+    return {cat: [re.compile(p) for p in pats] for cat, pats in rules_patterns.items()}
+
+_RULES = build_rules()
+
+# categorias antigas -> novas (aplicado quando a regra vencedora for uma delas)
+_RULES_REMAP = {
+    "Vazamento - Óleo": LEAK_OIL,
+    "Vazamento - Hidráulico": LEAK_OIL,
+    "Vazamento - Combustível": LEAK_FUEL,
+    "Mangueira (Vazamento)": LEAK_HOSE,
+}
+
+def build_rules_combined(rules):
+    """Uma única alternação por categoria (mesma ordem de prioridade de `rules`)."""
+    return {
+        cat: re.compile("|".join(f"(?:{p.pattern})" for p in pats))
+        for cat, pats in rules.items()
+    }
+
+# -------------------------
+# Pré-filtro por palavras-chave (Aho–Corasick) na frente das regex
+# -------------------------
+# Cada regex exige ao menos um trecho literal ("âncora") no texto: `\bfreio(s)?\b` -> "freio",
+# `\bl[aâ]mpada|farol|lanterna\b` -> {"mpada", "farol", "lanterna"}. Um único autômato varre o
+# texto e só as categorias com âncora encontrada rodam a regex completa, na ordem original.
+try:
+    from re import _parser as _sre_parse, _constants as _sre_c
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse, sre_constants as _sre_c
+
+def _ancoras(itens):
+    """Literais dos quais ao menos um aparece em todo match de `itens`; None se não houver."""
+    candidatos, run = [], ""
+    for op, av in itens:
+        if op is _sre_c.LITERAL:
+            run += chr(av)
+            continue
+        if run:
+            candidatos.append({run})
+            run = ""
+        sub = None
+        if op is _sre_c.SUBPATTERN:
+            sub = _ancoras(av[-1])
+        elif op is _sre_c.BRANCH:
+            ramos = [_ancoras(r) for r in av[1]]
+            sub = None if any(r is None for r in ramos) else set().union(*ramos)
+        elif op in (_sre_c.MAX_REPEAT, _sre_c.MIN_REPEAT) and av[0] >= 1:
+            sub = _ancoras(av[2])
+        if sub:
+            candidatos.append(sub)
+    if run:
+        candidatos.append({run})
+    # âncoras de 1 caractere não filtram nada
+    candidatos = [c for c in candidatos if min(map(len, c)) >= 2]
+    return max(candidatos, key=lambda c: min(map(len, c)), default=None)
+
+def build_keyword_index(rules):
+    """
+    Autômato Aho–Corasick (já como DFA: dict por estado) das âncoras de cada categoria.
+    `saida[estado]` = índices das categorias cujas âncoras terminam ali; `sempre` = categorias
+    com alguma regex sem âncora extraível (rodam sempre).
+    """
+    goto, saida, sempre = [{}], [set()], set()
+    for i, pats in enumerate(rules.values()):
+        for p in pats:
+            ancoras = _ancoras(_sre_parse.parse(p.pattern, p.flags))
+            if ancoras is None:
+                sempre.add(i)
+                continue
+            for a in ancoras:
+                s = 0
+                for ch in a:
+                    if ch not in goto[s]:
+                        goto.append({})
+                        saida.append(set())
+                        goto[s][ch] = len(goto) - 1
+                    s = goto[s][ch]
+                saida[s].add(i)
+
+    # BFS: link de falha + transições herdadas (DFA completo sobre os caracteres vistos)
+    delta = [dict(g) for g in goto]
+    falha = [0] * len(goto)
+    fila = list(goto[0].values())
+    while fila:
+        s = fila.pop(0)
+        for ch, prox in goto[s].items():
+            f = delta[falha[s]].get(ch, 0) if s else 0
+            falha[prox] = f if f != prox else 0
+            saida[prox] |= saida[falha[prox]]
+            fila.append(prox)
+        for ch, prox in delta[falha[s]].items():
+            delta[s].setdefault(ch, prox)
+    return {
+        "delta": delta,
+        "saida": [frozenset(x) for x in saida],
+        "sempre": frozenset(sempre),
+        "categorias": list(build_rules_combined(rules).items()),
+    }
+
+_KW_INDEX = build_keyword_index(_RULES)
+
+def categorias_candidatas(t: str, indice: dict = None) -> list:
+    """Índices (em ordem de prioridade) das categorias cujas âncoras aparecem em `t`."""
+    indice = indice or _KW_INDEX
+    delta, saida = indice["delta"], indice["saida"]
+    s, hits = 0, set(indice["sempre"])
+    for ch in t:
+        s = delta[s].get(ch, 0)
+        if saida[s]:
+            hits |= saida[s]
+    return sorted(hits)
+
+# sinais usados na decisão dos vazamentos
+_RE_LEAK  = re.compile(r"\bvaz[a-z]*\b")
+_RE_BREAK = re.compile(r"\b(romp|fur(ad|o)|estour|trinc|rachad)\b")
+_RE_FUEL  = re.compile(r"\b(diesel|combust|gasol|etanol)\b")
+_RE_HOSE  = re.compile(r"\bmangueir|flexivel|crimp|engate\s*rapid")
+_RE_MOTOR = re.compile(r"\bmotor(?!ista)\b")
+
+def classify_norm(t: str) -> str:
+    """Igual a `classify_rules`, mas recebe o texto JÁ normalizado (norm_txt)."""
+    if not t:
+        return "Não Classificado"
+
+    # sinais de vazamento/rompimento
+    has_leak = bool(_RE_LEAK.search(t))
+    has_break = bool(_RE_BREAK.search(t))
+
+    # combustível (diesel/gasolina/etanol/combust…)
+    has_fuel = bool(_RE_FUEL.search(t))
+
+    # mangueira / flexível / crimpagem / engate rápido
+    has_hose = bool(_RE_HOSE.search(t))
+    has_hose_problem = has_hose and (has_leak or has_break)
+
+    # --- decisão das 3 categorias de vazamento ---
+    if has_hose_problem:
+        return LEAK_HOSE
+    if has_leak and has_fuel:
+        return LEAK_FUEL
+    if has_leak:
+        # todo vazamento que não for combustível/mangueira cai aqui (óleo em geral)
+        return LEAK_OIL
+
+    # --- demais regras: só as categorias com âncora no texto (primeira que casar vence) ---
+    categorias = _KW_INDEX["categorias"]
+    for i in categorias_candidatas(t):
+        categoria, pat = categorias[i]
+        if pat.search(t):
+            # mapear categorias antigas para as novas quando aplicável
+            return _RULES_REMAP.get(categoria, categoria)
+
+    # fallback: menção clara a motor
+    if _RE_MOTOR.search(t):
+        return "Motor"
+
+    return "Não Classificado"
+
+def classify_rules(texto: str) -> str:
+    """Classificador por regras com prioridade para as 3 novas categorias de vazamento."""
+    return classify_norm(norm_txt(texto))
+
+# =========================
+# Cache persistente da classificação por regras (SQLite)
+# =========================
+CLASSIF_CACHE_PATH = os.environ.get("DASH_CLASSIF_CACHE", os.path.join(".cache", "classificacao.sqlite"))
+CLASSIF_CACHE_MAX_ROWS = int(os.environ.get("DASH_CLASSIF_CACHE_MAX", "500000"))
+_SQL_CHUNK = 900  # abaixo do limite de variáveis por consulta do SQLite
+
+def rules_version() -> str:
+    """Hash do conjunto de regras: qualquer edição de regex gera uma nova versão."""
+    payload = {
+        "rules": {cat: [p.pattern for p in pats] for cat, pats in _RULES.items()},
+        "remap": _RULES_REMAP,
+        "sinais": [r.pattern for r in (_RE_LEAK, _RE_BREAK, _RE_FUEL, _RE_HOSE, _RE_MOTOR)],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+RULES_VERSION = rules_version()
+
+def _classif_cache_conn():
+    pasta = os.path.dirname(CLASSIF_CACHE_PATH)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    con = sqlite3.connect(CLASSIF_CACHE_PATH, timeout=10)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS classif ("
+        " versao TEXT NOT NULL, texto TEXT NOT NULL, categoria TEXT NOT NULL,"
+        " usado_em REAL NOT NULL, PRIMARY KEY (versao, texto))"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS ix_classif_usado ON classif (usado_em)")
+    return con
+
+def classif_cache_get(textos, versao: str = None) -> dict:
+    """Busca no cache as categorias já conhecidas para `textos` (normalizados)."""
+    versao = versao or RULES_VERSION
+    textos = list(textos)
+    achados = {}
+    try:
+        con = _classif_cache_conn()
+    except Exception:
+        return achados
+    try:
+        agora = time.time()
+        for i in range(0, len(textos), _SQL_CHUNK):
+            bloco = textos[i:i + _SQL_CHUNK]
+            marcas = ",".join("?" * len(bloco))
+            cur = con.execute(
+                f"SELECT texto, categoria FROM classif WHERE versao = ? AND texto IN ({marcas})",
+                [versao, *bloco],
+            )
+            achados.update(cur.fetchall())
+        if achados:
+            # LRU: marca como usados para não serem despejados primeiro
+            con.executemany(
+                "UPDATE classif SET usado_em = ? WHERE versao = ? AND texto = ?",
+                [(agora, versao, t) for t in achados],
+            )
+            con.commit()
+    except Exception:
+        pass
+    finally:
+        con.close()
+    return achados
+
+def classif_cache_put(resultados: dict, versao: str = None, max_rows: int = None):
+    """Grava {texto_normalizado: categoria} e despeja as entradas menos usadas acima do limite."""
+    if not resultados:
+        return
+    versao = versao or RULES_VERSION
+    max_rows = CLASSIF_CACHE_MAX_ROWS if max_rows is None else max_rows
+    try:
+        con = _classif_cache_conn()
+    except Exception:
+        return
+    try:
+        agora = time.time()
+        con.executemany(
+            "INSERT OR REPLACE INTO classif (versao, texto, categoria, usado_em) VALUES (?, ?, ?, ?)",
+            [(versao, t, c, agora) for t, c in resultados.items()],
+        )
+        total = con.execute("SELECT COUNT(*) FROM classif").fetchone()[0]
+        if total > max_rows:
+            con.execute(
+                "DELETE FROM classif WHERE rowid IN ("
+                " SELECT rowid FROM classif ORDER BY usado_em ASC LIMIT ?)",
+                (total - max_rows,),
+            )
+        con.commit()
+    except Exception:
+        pass
+    finally:
+        con.close()
+
+# =========================
+# Classificação paralela (muitas descrições inéditas)
+# =========================
+CLASSIF_WORKERS = int(os.environ.get("DASH_CLASSIF_WORKERS", "0")) or (os.cpu_count() or 1)
+# abaixo disso subir processos custa mais do que classificar em série
+CLASSIF_PARALLEL_MIN = int(os.environ.get("DASH_CLASSIF_PARALLEL_MIN", "20000"))
+
+def contexto_processos():
+    """
+    Início dos processos filhos sem fork: os pools são abertos de dentro de threads
+    (servidor do Streamlit, trabalhos em segundo plano) e o fork de um processo com
+    threads pode travar o filho — um travamento que o fallback em série não pega.
+    forkserver onde existir (Linux/macOS), senão spawn; as funções dos filhos são
+    de nível de módulo neste arquivo, importável pelos dois.
+    """
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+def _classificar_lote(textos) -> list:
+    # roda no processo filho: regex e autômato (_KW_INDEX) já foram montados no import deste módulo
+    return [classify_norm(t) for t in textos]
+
+def _juntar_blocos(partes, total: int, progresso=None) -> list:
+    """Concatena os resultados por bloco na ordem, avisando `progresso(feitos, total)` a cada um."""
+    out = []
+    for parte in partes:
+        out.extend(parte)
+        if progresso is not None:
+            progresso(len(out), total)
+    return out
+
+def classify_norm_many(textos, workers: int = None, min_paralelo: int = None, progresso=None) -> list:
+    """
+    classify_norm para uma lista de textos normalizados, na mesma ordem.
+    Com muitos textos divide em blocos contíguos entre `workers` processos;
+    o resultado é idêntico ao da versão em série. Qualquer falha do pool cai na série.
+    `progresso(feitos, total)`, se dado, é chamado a cada bloco concluído.
+    """
+    textos = list(textos)
+    workers = CLASSIF_WORKERS if workers is None else workers
+    min_paralelo = CLASSIF_PARALLEL_MIN if min_paralelo is None else min_paralelo
+
+    def em_serie():
+        if progresso is None:
+            return _classificar_lote(textos)
+        tam = max(1000, -(-len(textos) // 50))
+        blocos = [textos[i:i + tam] for i in range(0, len(textos), tam)]
+        return _juntar_blocos(map(_classificar_lote, blocos), len(textos), progresso)
+
+    if workers <= 1 or len(textos) < max(min_paralelo, 2):
+        return em_serie()
+
+    n_blocos = workers * 4  # blocos menores equilibram descrições longas/curtas
+    tam = -(-len(textos) // n_blocos)
+    blocos = [textos[i:i + tam] for i in range(0, len(textos), tam)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=contexto_processos()) as pool:
+            return _juntar_blocos(pool.map(_classificar_lote, blocos), len(textos), progresso)
+    except Exception:
+        return em_serie()
+
+@medir_etapa("classificacao_regras")
+def classify_rules_batch(textos_norm: pd.Series, use_cache: bool = True, workers: int = None,
+                         progresso=None) -> pd.Series:
+    """
+    Classifica uma coluna JÁ normalizada (ex.: DE_SERVICO_N) de uma vez:
+    cada descrição distinta é classificada uma única vez e o resultado volta
+    para as linhas pelo código do factorize. Resultado idêntico a
+    `textos.apply(classify_rules)` sobre o texto bruto.
+
+    Com `use_cache`, descrições já vistas (mesma versão das regras) vêm do
+    cache em disco e só as inéditas passam pelas regras; essas podem ser
+    divididas entre processos (`workers`, ver classify_norm_many); `progresso`
+    acompanha as descrições inéditas classificadas.
+    """
+    codes, uniques = pd.factorize(textos_norm, sort=False)
+    uniques = np.asarray(uniques, dtype=object)
+    if (codes < 0).any():
+        # NaN vira texto vazio (mesmo resultado de fillna(""), que não vale para categóricas)
+        codes = np.where(codes < 0, len(uniques), codes)
+        uniques = np.append(uniques, "")
+    conhecidos = classif_cache_get(uniques) if use_cache and len(uniques) else {}
+    ineditos = [t for t in uniques if t not in conhecidos]
+    if use_cache:
+        contar_cache("classificacao_sqlite", hits=len(conhecidos), misses=len(ineditos))
+    novos = dict(zip(ineditos, classify_norm_many(ineditos, workers=workers, progresso=progresso)))
+    if use_cache:
+        classif_cache_put(novos)
+    conhecidos.update(novos)
+    cats = np.array([conhecidos[t] for t in uniques], dtype=object)
+    return pd.Series(cats[codes], index=textos_norm.index, dtype=object)
+
+# =========================
+# ML opcional: modelo cacheado (memória + disco opcional)
+# =========================
+ML_CACHE_DIR = os.environ.get("DASH_ML_CACHE", os.path.join(".cache", "ml"))
+ML_PERSIST = os.environ.get("DASH_ML_PERSIST", "0") == "1"
+ML_MEM_MAX = 8  # modelos mantidos em memória (LRU)
+# "tfidf": TF-IDF (1–2-gramas) + NB treinado do zero; "hashing": vetorizador sem estado
+# (HashingVectorizer) + NB com partial_fit em mini-lotes — memória limitada por
+# ML_HASH_FEATURES x nº de classes, qualquer que seja o tamanho da base
+ML_BACKEND = os.environ.get("DASH_ML_BACKEND", "tfidf")
+ML_HASH_FEATURES = int(os.environ.get("DASH_ML_HASH_FEATURES", str(2 ** 16)))
+ML_BATCH_ROWS = int(os.environ.get("DASH_ML_BATCH_ROWS", "20000"))
+
+# fingerprint -> {"pipe": Pipeline, "pred": {texto: (classe, prob)}}
+_ML_MODELS = OrderedDict()
+
+def _fingerprint(*series) -> str:
+    """Hash estável do conteúdo (valores + ordem) das séries informadas."""
+    h = hashlib.sha1()
+    for s in series:
+        h.update(pd.util.hash_pandas_object(s.reset_index(drop=True), index=False).to_numpy().tobytes())
+    return h.hexdigest()[:20]
+
+def ml_classes() -> np.ndarray:
+    """Todos os rótulos que as regras produzem (o NB incremental precisa deles já no 1º lote)."""
+    cats = {_RULES_REMAP.get(c, c) for c in _RULES} | {LEAK_OIL, LEAK_FUEL, LEAK_HOSE, "Motor"}
+    return np.array(sorted(cats), dtype=object)
+
+def ml_hashing_novo():
+    """Pipeline hashing + NB ainda sem treino (ver ml_partial_fit)."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import Pipeline
+
+    return Pipeline([
+        ("hash", HashingVectorizer(ngram_range=(1, 2), n_features=ML_HASH_FEATURES, alternate_sign=False)),
+        ("clf", MultinomialNB()),
+    ])
+
+def ml_partial_fit(pipe, textos: pd.Series, rotulos: pd.Series, lote: int = None):
+    """
+    Atualiza o pipeline hashing + NB com (textos, rotulos) em mini-lotes de `lote` pares.
+    Pares (texto, rótulo) repetidos entram uma vez, com peso = nº de ocorrências;
+    rótulos fora de ml_classes() (ex.: 'Não Classificado') são ignorados.
+    """
+    lote = lote or ML_BATCH_ROWS
+    classes = ml_classes()
+    pares = pd.DataFrame({"t": textos.to_numpy(dtype=object), "y": rotulos.to_numpy(dtype=object)})
+    pares = pares[pares["y"].isin(classes)]
+    pesos = pares.groupby(["t", "y"], sort=False).size().reset_index(name="n")
+    vetorizador, clf = pipe.named_steps["hash"], pipe.named_steps["clf"]
+    for i in range(0, len(pesos), lote):
+        b = pesos.iloc[i:i + lote]
+        # classes ainda sem exemplos têm prior log(0): o aviso de divisão por zero é esperado
+        with np.errstate(divide="ignore"):
+            clf.partial_fit(vetorizador.transform(b["t"]), b["y"].to_numpy(), classes=classes,
+                            sample_weight=b["n"].to_numpy(dtype=float))
+    return pipe
+
+def ml_fit_cached(textos: pd.Series, rotulos: pd.Series, persist: bool = None, backend: str = None):
+    """
+    Devolve (fingerprint, entrada do cache) para o pipeline de `backend` (TF-IDF + NB
+    ou hashing + NB) treinado em (textos, rotulos). Só treina se esse conjunto nunca foi visto.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import Pipeline
+
+    persist = ML_PERSIST if persist is None else persist
+    backend = backend or ML_BACKEND
+    fp = _fingerprint(textos, rotulos) + ("" if backend == "tfidf" else f"_{backend}{ML_HASH_FEATURES}")
+    if fp in _ML_MODELS:
+        _ML_MODELS.move_to_end(fp)
+        contar_cache("ml_modelo", hits=1)
+        return fp, _ML_MODELS[fp]
+    contar_cache("ml_modelo", misses=1)
+
+    caminho = os.path.join(ML_CACHE_DIR, f"nb_{fp}.pkl")
+    pipe = None
+    if persist and os.path.exists(caminho):
+        try:
+            with open(caminho, "rb") as f:
+                pipe = pickle.load(f)
+        except Exception:
+            pipe = None
+    if pipe is None:
+        with etapa("ml_treino", linhas=len(textos), backend=backend):
+            if backend == "hashing":
+                pipe = ml_partial_fit(ml_hashing_novo(), textos, rotulos)
+            else:
+                pipe = Pipeline([("tfidf", TfidfVectorizer(ngram_range=(1, 2), min_df=3)), ("clf", MultinomialNB())])
+                pipe.fit(textos, rotulos)
+        if persist:
+            try:
+                os.makedirs(ML_CACHE_DIR, exist_ok=True)
+                with open(caminho, "wb") as f:
+                    pickle.dump(pipe, f)
+            except Exception:
+                pass
+
+    _ML_MODELS[fp] = {"pipe": pipe, "pred": {}}
+    while len(_ML_MODELS) > ML_MEM_MAX:
+        _ML_MODELS.popitem(last=False)
+    return fp, _ML_MODELS[fp]
+
+@medir_etapa("ml_reclass")
+def ml_reclass_optional(df_base: pd.DataFrame, col_txt: str, col_cat_in: str, threshold: float = 0.6,
+                        df_treino: pd.DataFrame = None, persist: bool = None, backend: str = None,
+                        modelo: dict = None):
+    """
+    Reclassifica apenas 'Não Classificado' com Naive Bayes (TF-IDF ou hashing, ver
+    ML_BACKEND), se scikit-learn estiver disponível.
+
+    O modelo é cacheado pelo fingerprint das linhas de treino e as previsões por
+    descrição ficam guardadas junto dele: mudar só o `threshold` não re-treina nem
+    re-prevê. `df_treino` (mesmas colunas) permite treinar uma vez na base completa
+    em vez de no recorte filtrado. `modelo` ({"pipe", "pred"}, ex.: o modelo hashing
+    mantido pelo carregar_incremental) dispensa o treino.
+    """
+    try:
+        import sklearn  # noqa: F401
+    except Exception:
+        return df_base[col_cat_in]
+
+    mask_nc = df_base[col_cat_in].eq("Não Classificado")
+    if mask_nc.sum() == 0:
+        return df_base[col_cat_in]
+
+    if modelo is None:
+        base_treino = df_base if df_treino is None else df_treino
+        train = base_treino[~base_treino[col_cat_in].isin(["Não Classificado", "Avaliar"])]
+        if train.empty or train[col_txt].str.len().sum() == 0:
+            return df_base[col_cat_in]
+        _, modelo = ml_fit_cached(train[col_txt], train[col_cat_in], persist=persist, backend=backend)
+    pipe, pred_cache = modelo["pipe"], modelo["pred"]
+
+    # prevê só as descrições distintas ainda não vistas por este modelo
+    textos_nc = df_base.loc[mask_nc, col_txt].astype(object)
+    novos = [t for t in pd.unique(textos_nc) if t not in pred_cache]
+    contar_cache("ml_previsoes", hits=textos_nc.nunique() - len(novos), misses=len(novos))
+    if novos:
+        proba = pipe.predict_proba(novos)
+        classes = pipe.classes_
+        for t, i, p in zip(novos, proba.argmax(axis=1), proba.max(axis=1)):
+            pred_cache[t] = (classes[i], float(p))
+
+    pred = textos_nc.map(lambda t: pred_cache[t][0])
+    top_prob = textos_nc.map(lambda t: pred_cache[t][1])
+
+    out = df_base[col_cat_in].copy()
+    ok = top_prob >= threshold
+    out.loc[ok[ok].index] = pred[ok]
+    return out
+
+# =========================
+# Cubo de agregados (Gráficos 1–5)
+# =========================
+CUBE_KEYS = ["ISO_ANO", "ISO_SEMANA", "CD_CLASMANU_CODE", "CD_CLASMANU_DESC", "CD_EQUIPTO", "Componente", "Dia"]
+COMPONENTE_PENDENTE = "(não classificado ainda)"
+
+@medir_etapa("montar_cubo")
+def montar_cubo(df: pd.DataFrame, componentes: pd.Series = None) -> dict:
+    """
+    Agrega a base uma vez por (semana ISO, classe, equipamento, componente, dia):
+    contagem de OS e soma de horas. Os gráficos filtrados passam a somar células
+    do cubo; a seleção por semana usa o índice `semanas`, então o custo de um
+    filtro acompanha o número de semanas escolhidas, não o de linhas.
+
+    Sem `componentes` (classificação ainda não feita) o componente fica constante
+    (COMPONENTE_PENDENTE): o cubo serve aos Gráficos 2–5, não ao Gráfico 1.
+    """
+    horas = pd.to_numeric(df["Tempo de Permanência(h)"], errors="coerce").astype("float64")  # soma em float64 (coluna pode ser float32)
+    base = pd.DataFrame({
+        "ISO_ANO": df["ISO_ANO"],
+        "ISO_SEMANA": df["ISO_SEMANA"],
+        "CD_CLASMANU_CODE": df["CD_CLASMANU_CODE"],
+        "CD_CLASMANU_DESC": df["CD_CLASMANU_DESC"].astype(str).replace({"": "Não informado"}),
+        "CD_EQUIPTO": df["CD_EQUIPTO"].astype(str).str.replace(r"\.0$", "", regex=True).replace({"": "Não informado"}),
+        "Componente": (componentes.astype(str).replace({"": "Não Classificado"})
+                       if componentes is not None else COMPONENTE_PENDENTE),
+        "Dia": df["ENTRADA"].dt.floor("D") if "ENTRADA" in df.columns else pd.NaT,
+        "Horas": horas,
+        "Horas_n": horas.notna().astype("int32"),
+    }, index=df.index)
+
+    cubo = (
+        base.groupby(CUBE_KEYS, dropna=False, observed=True, sort=False)
+        .agg(OS=("Horas_n", "size"), Horas=("Horas", "sum"), Horas_n=("Horas_n", "sum"))
+        .reset_index()
+    )
+    return _indexar_cubo(cubo)
+
+def _indexar_cubo(cubo: pd.DataFrame) -> dict:
+    semanas = {
+        (int(a), int(s)): pos
+        for (a, s), pos in cubo.groupby(["ISO_ANO", "ISO_SEMANA"], sort=False).indices.items()
+    }
+    return {"cubo": cubo, "semanas": semanas}
+
+def combinar_cubos(base: dict, somar: dict = None, subtrair: dict = None) -> dict:
+    """Atualiza um cubo somando/subtraindo as células de outros (contagens e horas são aditivas)."""
+    partes = [base["cubo"]]
+    if somar is not None:
+        partes.append(somar["cubo"])
+    if subtrair is not None:
+        neg = subtrair["cubo"].copy()
+        neg[["OS", "Horas", "Horas_n"]] *= -1
+        partes.append(neg)
+    cubo = (
+        pd.concat(partes, ignore_index=True)
+        .groupby(CUBE_KEYS, dropna=False, observed=True, sort=False)[["OS", "Horas", "Horas_n"]].sum()
+        .reset_index()
+    )
+    return _indexar_cubo(cubo[cubo["OS"] > 0].reset_index(drop=True))
+
+def selecionar_cubo(info: dict, ano_sel=None, semanas_sel=None, op_clas=None) -> pd.DataFrame:
+    """Células do cubo para o filtro (ano_sel=None: sem filtro de semana)."""
+    cubo = info["cubo"]
+    if ano_sel is not None:
+        pos = [info["semanas"][k] for k in ((int(ano_sel), int(s)) for s in (semanas_sel or [])) if k in info["semanas"]]
+        cubo = cubo.iloc[np.concatenate(pos)] if pos else cubo.iloc[0:0]
+    if op_clas:
+        cubo = cubo[cubo["CD_CLASMANU_CODE"].isin(op_clas)]
+    return cubo
+
+def _top(sel: pd.DataFrame, chave: str, valor: str, nome: str, n: int = None) -> pd.DataFrame:
+    out = sel.groupby(chave, sort=False, observed=True)[valor].sum().reset_index(name=nome)
+    out = out[out[nome] > 0].sort_values([nome, chave], ascending=[False, True], kind="stable")
+    return (out.head(n) if n else out).reset_index(drop=True)
+
+def tabela_componentes(sel: pd.DataFrame) -> pd.DataFrame:
+    return _top(sel, "Componente", "OS", "Ocorrências")
+
+def tabela_classes(sel: pd.DataFrame) -> pd.DataFrame:
+    return _top(sel, "CD_CLASMANU_DESC", "OS", "Quantidade", n=10).rename(columns={"CD_CLASMANU_DESC": "Descricao"})
+
+def tabela_os_equipamento(sel: pd.DataFrame) -> pd.DataFrame:
+    return _top(sel, "CD_EQUIPTO", "OS", "OS", n=10)
+
+def tabela_horas_equipamento(sel: pd.DataFrame) -> pd.DataFrame:
+    com_horas = sel[sel["Horas_n"] > 0]
+    out = com_horas.groupby("CD_EQUIPTO", sort=False, observed=True)["Horas"].sum().reset_index(name="Tempo de Permanência(h)")
+    out = out.sort_values(["Tempo de Permanência(h)", "CD_EQUIPTO"], ascending=[False, True], kind="stable")
+    return out.head(10).reset_index(drop=True)
+
+def tabela_diaria(sel: pd.DataFrame) -> pd.DataFrame:
+    com_dia = sel[sel["Dia"].notna()]
+    return (
+        com_dia.groupby("Dia", sort=True)["OS"].sum()
+        .rename_axis("Data de Entrada").reset_index(name="Quantidade")
+    )
+
+def tabela_mensal(df: pd.DataFrame) -> pd.DataFrame:
+    """Gráfico 6: OS por mês (base inteira, sem filtro de período)."""
+    return df.dropna(subset=["Ano/Mes"]).groupby("Ano/Mes").size().reset_index(name="Quantidade")
+
+def combinar_mensal(base: pd.DataFrame, somar: pd.DataFrame = None, subtrair: pd.DataFrame = None) -> pd.DataFrame:
+    """Atualiza a série mensal com as contagens de linhas novas/removidas."""
+    partes = [base]
+    if somar is not None:
+        partes.append(somar)
+    if subtrair is not None:
+        partes.append(subtrair.assign(Quantidade=-subtrair["Quantidade"]))
+    g6 = pd.concat(partes, ignore_index=True).groupby("Ano/Mes")["Quantidade"].sum().reset_index()
+    return g6[g6["Quantidade"] > 0].reset_index(drop=True)
+
+def tabela_nao_classificadas(df_clf: pd.DataFrame, col_cat: str = "Componente Detectado (final)", n: int = 50) -> pd.DataFrame:
+    """Triagem: descrições mais frequentes entre as que ficaram 'Não Classificado'."""
+    nao_cls = df_clf[df_clf[col_cat] == "Não Classificado"]
+    return (
+        nao_cls["DE_SERVICO"]
+        .astype(object)
+        .value_counts()
+        .reset_index(name="Ocorrências")
+        .rename(columns={"index": "Descrição"})
+        .head(n)
+    )
+
+# =========================
+# Confiabilidade: MTBF / MTTR / disponibilidade por equipamento e componente
+# =========================
+# cada parada não programada é uma falha: OS sobrepostas (ou encostadas) do mesmo
+# equipamento — ou equipamento + componente — viram um único evento, da primeira ENTRADA
+# ao maior fim de reparo. TTR = duração do evento; TBF = início − fim do evento anterior
+CHAVES_CONFIABILIDADE = {"equipamento": ["CD_EQUIPTO"], "componente": ["CD_EQUIPTO", "Componente"]}
+
+def eventos_confiabilidade(df: pd.DataFrame, componentes: pd.Series, por: str = "equipamento") -> pd.DataFrame:
+    """
+    Eventos de parada por equipamento (`por="componente"`: por equipamento + componente),
+    com OS, TTR e TBF em horas — ordenação única e cummax/shift agrupados, sem laço.
+
+    Um evento começa quando a ENTRADA passa do maior fim de reparo (SAIDA; OS aberta
+    conta como terminada na entrada) das OS anteriores do grupo; sem nenhuma SAIDA o
+    TTR fica vazio. O TBF usa o histórico inteiro da base, então um recorte por
+    semana/classe ainda enxerga o evento anterior fora dele; semana e classe do evento
+    são as da OS que o abriu.
+    """
+    chave = CHAVES_CONFIABILIDADE[por]
+    cols = [c for c in ["CD_EQUIPTO", "ENTRADA", "SAIDA", "ISO_ANO", "ISO_SEMANA", "CD_CLASMANU_CODE"] if c in df.columns]
+    ev = df[cols].assign(Componente=componentes.reindex(df.index).to_numpy())
+    # sem ENTRADA não há evento (o quadro sai vazio, com as mesmas colunas); sem SAIDA não há TTR
+    for col in ("ENTRADA", "SAIDA"):
+        if col not in ev.columns:
+            ev[col] = pd.NaT
+    ev = ev[ev["ENTRADA"].notna() & ev["CD_EQUIPTO"].ne("Não informado")]
+    ev = ev.sort_values(chave + ["ENTRADA"], kind="stable")
+
+    fim = ev["SAIDA"].fillna(ev["ENTRADA"])
+    grupos = [ev[c] for c in chave]
+    fim_max = fim.groupby(grupos, observed=True, sort=False).cummax()
+    fim_anterior = fim_max.groupby(grupos, observed=True, sort=False).shift()
+    novo = (fim_anterior.isna() | (ev["ENTRADA"] > fim_anterior)).to_numpy()
+    inicios = np.flatnonzero(novo)
+    finais = np.append(inicios[1:], len(ev))[:len(inicios)] - 1
+
+    # float64, como as horas do cubo: médias/somas em float32 saem com ruído (22.290477752685547)
+    horas = lambda delta: (delta.dt.total_seconds() / 3600.0).clip(lower=0)
+    out = ev.iloc[inicios].drop(columns=["SAIDA"])
+    out["FIM"] = fim_max.to_numpy()[finais]
+    out["OS"] = np.diff(np.append(inicios, len(ev))).astype("int32")
+    com_saida = np.add.reduceat(ev["SAIDA"].notna().to_numpy(dtype="int32"), inicios) > 0 if len(ev) else []
+    out["TTR"] = horas(out["FIM"] - out["ENTRADA"]).where(com_saida)
+    out["TBF"] = horas(out["ENTRADA"] - fim_anterior.iloc[inicios])
+    return out
+
+def tabela_confiabilidade(ev: pd.DataFrame, por: str = "equipamento", n: int = None) -> pd.DataFrame:
+    """
+    Falhas (eventos), OS, MTBF, MTTR, horas paradas e disponibilidade (MTBF / (MTBF + MTTR))
+    por equipamento ou por componente, ordenado pelas horas paradas. `ev` vem de
+    eventos_confiabilidade com o mesmo `por`.
+    """
+    chave = "CD_EQUIPTO" if por == "equipamento" else "Componente"
+    out = (
+        ev.groupby(chave, observed=True, sort=False)
+        .agg(Falhas=("ENTRADA", "size"), OS=("OS", "sum"), MTBF=("TBF", "mean"), MTTR=("TTR", "mean"),
+             Paradas=("TTR", "sum"))
+        .reset_index()
+    )
+    out["Disponibilidade"] = out["MTBF"] / (out["MTBF"] + out["MTTR"])
+    out[chave] = out[chave].astype(str)
+    out = out.sort_values(["Paradas", chave], ascending=[False, True], kind="stable").reset_index(drop=True)
+    out = out.rename(columns={"MTBF": "MTBF (h)", "MTTR": "MTTR (h)", "Paradas": "Horas paradas"})
+    return out.head(n) if n else out
+
+# =========================
+# Filtros e seleção padrão (mesma lógica da barra lateral)
+# =========================
+def semanas_disponiveis(df: pd.DataFrame, ano) -> list:
+    return sorted(df.loc[(df["ISO_ANO"] == ano) & df["ISO_SEMANA"].notna(), "ISO_SEMANA"].unique().tolist())
+
+def selecao_padrao(df: pd.DataFrame, n_semanas: int = 4):
+    """(ano, semanas) padrão do dashboard: último ano ISO e suas últimas `n_semanas` semanas."""
+    if "ISO_ANO" not in df.columns or not df["ISO_ANO"].notna().any():
+        return None, []
+    ano = sorted(df.loc[df["ISO_ANO"].notna(), "ISO_ANO"].unique().tolist())[-1]
+    return ano, semanas_disponiveis(df, ano)[-n_semanas:]
+
+def mascara_filtro(df: pd.DataFrame, ano_sel=None, semanas_sel=None, op_clas=None) -> pd.Series:
+    """Máscara de linhas para semana ISO (ano_sel=None: sem filtro de semana) + classe."""
+    mask_clas = df["CD_CLASMANU_CODE"].isin(op_clas) if op_clas else pd.Series(True, index=df.index)
+    if ano_sel is None:
+        mask_semana = pd.Series(True, index=df.index)
+    elif not semanas_sel:
+        mask_semana = pd.Series(False, index=df.index)
+    else:
+        mask_semana = (df["ISO_ANO"].eq(ano_sel)) & (df["ISO_SEMANA"].isin(semanas_sel))
+    return mask_semana & mask_clas
+
+def componentes_finais(df_clf: pd.DataFrame, use_ml: bool = True, threshold: float = 0.6,
+                       df_treino: pd.DataFrame = None, backend: str = None, modelo: dict = None) -> pd.Series:
+    """'Componente Detectado (final)': regras (Comp_Rules) + reclassificação ML opcional."""
+    if not use_ml:
+        return df_clf["Comp_Rules"]
+    return ml_reclass_optional(df_clf, "DE_SERVICO_N", "Comp_Rules", threshold=threshold, df_treino=df_treino,
+                               backend=backend, modelo=modelo)
+
+def tabela_componentes_linhas(componentes: pd.Series) -> pd.DataFrame:
+    """Gráfico 1 a partir das linhas (quando o ML altera os componentes do recorte)."""
+    g4 = componentes.astype(str).replace({"": "Não Classificado"}).value_counts(dropna=False).reset_index()
+    g4.columns = ["Componente", "Ocorrências"]
+    return g4
+
+# =========================
+# Gráficos (Altair)
+# =========================
+def grafico_componentes(g4: pd.DataFrame):
+    g4 = g4.copy()
+    g4["Ocorrências"] = pd.to_numeric(g4["Ocorrências"], errors="coerce").fillna(0)
+
+    # nome “bonito” só para exibir
+    g4["Componente_Display"] = g4["Componente"].map(DISPLAY_RENAME).fillna(g4["Componente"])
+
+    # manter a ordenação por quantidade, mas usando o nome de exibição no eixo
+    ordem_original = g4.sort_values("Ocorrências", ascending=False)["Componente"].tolist()
+    ordem_display = [DISPLAY_RENAME.get(c, c) for c in ordem_original]
+
+    return (
+        alt.Chart(g4)
+        .mark_bar(color=COLOR)
+        .encode(
+            y=alt.Y(
+                "Componente_Display:N",
+                sort=ordem_display,
+                title="Componente",
+                axis=alt.Axis(labelLimit=2000)  # evita “…” nas labels
+            ),
+            x=alt.X("Ocorrências:Q", title="Ocorrências"),
+            tooltip=[
+                alt.Tooltip("Componente_Display:N", title="Componente"),
+                alt.Tooltip("Componente:N", title="Nome original"),
+                alt.Tooltip("Ocorrências:Q", title="Ocorrências"),
+            ],
+        )
+        .properties(width=800, height=380)
+    )
+
+def grafico_classes(g1: pd.DataFrame):
+    ordem = g1.sort_values("Quantidade", ascending=False)["Descricao"].tolist()
+    return alt.Chart(g1).mark_bar(color=COLOR).encode(
+        y=alt.Y("Descricao:N", sort=ordem, title="Classe de Manutenção"),
+        x=alt.X("Quantidade:Q", title="Quantidade"),
+        tooltip=["Descricao", "Quantidade"]
+    ).properties(width=800, height=380)
+
+def grafico_os_equipamento(g2: pd.DataFrame):
+    ordem = g2.sort_values("OS", ascending=False)["CD_EQUIPTO"].tolist()
+    return alt.Chart(g2).mark_bar(color=COLOR).encode(
+        y=alt.Y("CD_EQUIPTO:N", sort=ordem, title="Equipamento"),
+        x=alt.X("OS:Q", title="Quantidade de OS"),
+        tooltip=[alt.Tooltip("CD_EQUIPTO:N", title="Equipamento"), "OS:Q"]
+    ).properties(width=800, height=380)
+
+def grafico_horas_equipamento(g3: pd.DataFrame):
+    ordem = g3.sort_values("Tempo de Permanência(h)", ascending=False)["CD_EQUIPTO"].tolist()
+    return alt.Chart(g3).mark_bar(color=COLOR).encode(
+        y=alt.Y("CD_EQUIPTO:N", sort=ordem, title="Equipamento"),
+        x=alt.X("Tempo de Permanência(h):Q", title="Tempo (h)"),
+        tooltip=[
+            alt.Tooltip("CD_EQUIPTO:N", title="Equipamento"),
+            alt.Tooltip("Tempo de Permanência(h):Q", title="Tempo (h)", format=".2f")
+        ]
+    ).properties(width=800, height=380)
+
+# -------------------------
+# Resolução adaptativa das séries temporais (Gráficos 5 e 6)
+# -------------------------
+# o Altair embute os dados no spec: acima de MAX_MARCAS pontos a série é reagrupada
+# no servidor (dia -> semana -> mês -> trimestre -> ano) e o spec fica limitado
+MAX_MARCAS = int(os.environ.get("DASH_MAX_MARCAS", "120"))
+# resolução -> (período pandas, formato do eixo, título do eixo)
+RESOLUCOES = {
+    "dia": ("D", "%d/%m", "Data"),
+    "semana": ("W-SUN", "%d/%m/%y", "Semana (início)"),
+    "mês": ("M", "%m/%Y", "Ano/Mês"),
+    "trimestre": ("Q", "%m/%Y", "Trimestre (início)"),
+    "ano": ("Y", "%Y", "Ano"),
+}
+
+def agrupar_serie(tabela: pd.DataFrame, col_data: str, resolucao: str = "auto",
+                  base: str = "dia", max_marcas: int = None):
+    """
+    Soma `Quantidade` por período: (tabela_agrupada, resolução_usada).
+
+    `resolucao="auto"` parte de `base` e usa a menor resolução cujo nº de períodos no
+    intervalo cabe em `max_marcas`; uma resolução explícita também sobe de nível se
+    passar do limite. A data de cada período é o seu início (semana ISO: segunda-feira).
+    """
+    max_marcas = max_marcas or MAX_MARCAS
+    niveis = list(RESOLUCOES)
+    inicio = niveis.index(base if resolucao == "auto" else resolucao)
+    datas = pd.to_datetime(tabela[col_data])
+    if datas.notna().sum() == 0:
+        return tabela, niveis[inicio]
+
+    escolhida = niveis[-1]
+    for nivel in niveis[inicio:]:
+        freq = RESOLUCOES[nivel][0]
+        n = (datas.max().to_period(freq) - datas.min().to_period(freq)).n + 1
+        if n <= max_marcas:
+            escolhida = nivel
+            break
+    if escolhida == base:
+        return tabela, escolhida
+
+    periodo = datas.dt.to_period(RESOLUCOES[escolhida][0]).dt.start_time.rename(col_data)
+    out = tabela.groupby(periodo, sort=True)["Quantidade"].sum().reset_index()
+    # o nível mais grosso não tem para onde subir: mantém só os `max_marcas` períodos mais recentes
+    return out.tail(max_marcas).reset_index(drop=True), escolhida
+
+def grafico_diario(g5: pd.DataFrame, resolucao: str = "auto", max_marcas: int = None, ja_agrupada: bool = False):
+    """Barras por período; `ja_agrupada`: g5 já saiu de agrupar_serie na `resolucao` dada (não reagrupa)."""
+    if not ja_agrupada:
+        g5, resolucao = agrupar_serie(g5, "Data de Entrada", resolucao, base="dia", max_marcas=max_marcas)
+    _, formato, titulo = RESOLUCOES[resolucao]
+    return alt.Chart(g5).mark_bar(color=COLOR).encode(
+        x=alt.X("Data de Entrada:T", title=titulo, axis=alt.Axis(format=formato)),
+        y=alt.Y("Quantidade:Q", title=f"OS por {resolucao}", scale=alt.Scale(domainMin=1)),
+        tooltip=[alt.Tooltip("Data de Entrada:T", title="Data", format="%d/%m/%Y"),
+                 alt.Tooltip("Quantidade:Q", title="Qtd")]
+    ).properties(width=800, height=380)
+
+def grafico_mensal(g6: pd.DataFrame, resolucao: str = "auto", max_marcas: int = None, ja_agrupada: bool = False):
+    """Linha por período; `ja_agrupada`: g6 já saiu de agrupar_serie na `resolucao` dada (não reagrupa)."""
+    if not ja_agrupada:
+        g6, resolucao = agrupar_serie(g6, "Ano/Mes", resolucao, base="mês", max_marcas=max_marcas)
+    _, formato, titulo = RESOLUCOES[resolucao]
+    return alt.Chart(g6).mark_line(point=True, color=COLOR).encode(
+        x=alt.X("Ano/Mes:T", title=titulo, axis=alt.Axis(format=formato)),
+        y=alt.Y("Quantidade:Q", title="Quantidade de OS"),
+        tooltip=[alt.Tooltip("Ano/Mes:T", title="Ano/Mês", format="%m/%Y"), alt.Tooltip("Quantidade:Q", title="Qtd")]
+    ).properties(width=800, height=380)
+
+def grafico_confiabilidade(g7: pd.DataFrame, por: str = "equipamento", max_marcas: int = None):
+    """Dispersão MTBF × MTTR (tamanho = falhas, cor = disponibilidade) dos itens com mais horas paradas."""
+    chave = "CD_EQUIPTO" if por == "equipamento" else "Componente"
+    g7 = g7.dropna(subset=["MTBF (h)", "MTTR (h)"]).head(max_marcas or MAX_MARCAS)
+    return alt.Chart(g7).mark_circle(opacity=0.8).encode(
+        x=alt.X("MTBF (h):Q", title="MTBF (h) — tempo médio entre falhas"),
+        y=alt.Y("MTTR (h):Q", title="MTTR (h) — tempo médio de reparo"),
+        size=alt.Size("Falhas:Q", title="Falhas"),
+        color=alt.Color("Disponibilidade:Q", scale=alt.Scale(scheme="redyellowgreen", domain=[0, 1]),
+                        legend=alt.Legend(format=".0%")),
+        tooltip=[
+            alt.Tooltip(f"{chave}:N", title="Equipamento" if por == "equipamento" else "Componente"),
+            alt.Tooltip("Falhas:Q"),
+            alt.Tooltip("OS:Q"),
+            alt.Tooltip("MTBF (h):Q", format=".1f"),
+            alt.Tooltip("MTTR (h):Q", format=".1f"),
+            alt.Tooltip("Horas paradas:Q", format=".1f"),
+            alt.Tooltip("Disponibilidade:Q", format=".1%"),
+        ]
+    ).properties(width=800, height=420)
+
+# nome do arquivo de saída -> função do gráfico (relatório em lote)
+GRAFICOS = {
+    "g1_componentes": grafico_componentes,
+    "g2_classes": grafico_classes,
+    "g3_os_equipamento": grafico_os_equipamento,
+    "g4_horas_equipamento": grafico_horas_equipamento,
+    "g5_diaria": grafico_diario,
+    "g6_mensal": grafico_mensal,
+    "g7_confiabilidade": grafico_confiabilidade,
+}
+
+# =========================
+# Relatório completo (uso fora do Streamlit)
+# =========================
+def gerar_tabelas(df: pd.DataFrame, ano_sel=None, semanas_sel=None, op_clas=None,
+                  use_ml: bool = True, ml_threshold: float = 0.6, ml_base_completa: bool = False,
+                  comp_rules: pd.Series = None, cubo: dict = None, ml_backend: str = None) -> dict:
+    """
+    Todas as tabelas do dashboard para um recorte de `df` (já sem planejadas).
+    Devolve {nome: DataFrame} com as mesmas chaves de GRAFICOS + "nao_classificadas_top50" e "confiabilidade_componentes".
+    """
+    if comp_rules is None:
+        comp_rules = classify_rules_batch(df["DE_SERVICO_N"])
+    if cubo is None:
+        cubo = montar_cubo(df, comp_rules)
+    sel = selecionar_cubo(cubo, ano_sel, semanas_sel, op_clas)
+
+    df_clf = df[mascara_filtro(df, ano_sel, semanas_sel, op_clas)].copy()
+    df_clf["Comp_Rules"] = comp_rules.loc[df_clf.index]
+    df_treino = df[["DE_SERVICO_N"]].assign(Comp_Rules=comp_rules) if (use_ml and ml_base_completa) else None
+    df_clf["Componente Detectado (final)"] = componentes_finais(df_clf, use_ml, ml_threshold, df_treino, ml_backend)
+    ev_equip = eventos_confiabilidade(df, comp_rules, "equipamento")
+    ev_comp = eventos_confiabilidade(df, comp_rules, "componente")
+
+    return {
+        "g1_componentes": tabela_componentes_linhas(df_clf["Componente Detectado (final)"]) if use_ml else tabela_componentes(sel),
+        "g2_classes": tabela_classes(sel),
+        "g3_os_equipamento": tabela_os_equipamento(sel),
+        "g4_horas_equipamento": tabela_horas_equipamento(sel),
+        "g5_diaria": tabela_diaria(sel),
+        "g6_mensal": tabela_mensal(df),
+        "nao_classificadas_top50": tabela_nao_classificadas(df_clf),
+        "g7_confiabilidade": tabela_confiabilidade(
+            ev_equip[mascara_filtro(ev_equip, ano_sel, semanas_sel, op_clas)], "equipamento"),
+        "confiabilidade_componentes": tabela_confiabilidade(
+            ev_comp[mascara_filtro(ev_comp, ano_sel, semanas_sel, op_clas)], "componente"),
+    }
+
+# =========================
+# Ingestão incremental (export acumulado)
+# =========================
+INCREMENTAL_DIR = os.environ.get("DASH_INCREMENTAL_DIR", os.path.join(".cache", "incremental"))
+
+# colunas que identificam a OS, se vierem no export (usadas como chave quando únicas)
+OS_KEY_CANDIDATES = ["NR_OS", "NU_OS", "CD_OS", "NUM_OS", "NUMERO_OS", "NR_ORDEM", "OS"]
+
+def _texto_canonico(raw: pd.DataFrame) -> pd.DataFrame:
+    """Valores como texto, estáveis entre exports (12 e 12.0 viram '12'; vazio vira '')."""
+    out = {}
+    for c in raw.columns:
+        s = raw[c]
+        txt = s.astype(str)
+        if pd.api.types.is_float_dtype(s):
+            txt = txt.str.replace(r"\.0$", "", regex=True)
+        out[c] = txt.where(s.notna(), "")
+    return pd.DataFrame(out, index=raw.index)
+
+def chaves_linhas(raw: pd.DataFrame):
+    """
+    (chave, hash, coluna_chave) por linha do export bruto.
+    Chave = nº da OS quando existe e é única; senão hash do conteúdo + nº da ocorrência
+    (linhas idênticas continuam distintas). O hash detecta linhas alteradas.
+    """
+    canon = _texto_canonico(raw)
+    h = pd.util.hash_pandas_object(canon[sorted(canon.columns)], index=False).to_numpy()
+    col = next((c for c in OS_KEY_CANDIDATES if c in raw.columns), None)
+    if col is not None and canon[col].ne("").all() and canon[col].is_unique:
+        return canon[col].reset_index(drop=True), h, col
+    hs = pd.Series(h).astype(str)
+    return hs + "#" + hs.groupby(hs).cumcount().astype(str), h, None
+
+def _estado_path(nome_base: str) -> str:
+    return os.path.join(INCREMENTAL_DIR, re.sub(r"[^\w\-]+", "_", str(nome_base)) or "base")
+
+def _ler_estado(nome_base: str, versao: str, colunas: list):
+    caminho = _estado_path(nome_base)
+    try:
+        import pyarrow.feather as feather
+        with open(caminho + ".pkl", "rb") as f:
+            meta = pickle.load(f)
+        if meta.get("versao") != versao or meta.get("colunas") != colunas:
+            return None, None  # regras/derivação ou layout do export mudaram: reprocessa tudo
+        linhas = feather.read_table(caminho + ".feather", memory_map=True).to_pandas()
+        return linhas, meta
+    except Exception:
+        return None, None
+
+def _gravar_estado(nome_base: str, linhas: pd.DataFrame, meta: dict):
+    try:
+        import pyarrow.feather as feather
+        os.makedirs(INCREMENTAL_DIR, exist_ok=True)
+        caminho = _estado_path(nome_base)
+        feather.write_feather(linhas.reset_index(drop=True), caminho + ".feather.tmp", compression="uncompressed")
+        with open(caminho + ".pkl.tmp", "wb") as f:
+            pickle.dump(meta, f)
+        os.replace(caminho + ".feather.tmp", caminho + ".feather")
+        os.replace(caminho + ".pkl.tmp", caminho + ".pkl")
+    except Exception:
+        contar_cache("incremental_estado", falhas=1)  # próximo export reprocessa tudo
+
+def _processar_delta(raw_delta: pd.DataFrame):
+    """Derivação, filtro de planejadas e regras só para as linhas novas/alteradas."""
+    df = derivar_colunas(raw_delta.copy())
+    _, mask, cols = aplicar_filtro_nao_programadas(df)
+    df["_PLANEJADA"] = mask.to_numpy()
+    df["Comp_Rules"] = classify_rules_batch(df["DE_SERVICO_N"])
+    return df, cols
+
+def _atualizar_ml_incremental(nome_base: str, versao: str, delta: pd.DataFrame, todas: pd.DataFrame,
+                              recomecar: bool):
+    """
+    Modelo hashing + NB da base `nome_base`, atualizado (partial_fit) só com as linhas
+    novas/alteradas: o treino de cada export custa o delta, não a base acumulada.
+    Sem modelo salvo compatível, treina uma vez em `todas`.
+    Devolve {"pipe", "pred"} (formato de ml_reclass_optional) ou None sem scikit-learn/treino.
+    """
+    try:
+        import sklearn  # noqa: F401
+    except Exception:
+        return None
+    caminho = _estado_path(nome_base) + ".ml.pkl"
+    versao = f"{versao}:hashing{ML_HASH_FEATURES}"
+    pipe = None
+    if not recomecar and os.path.exists(caminho):
+        try:
+            with open(caminho, "rb") as f:
+                salvo = pickle.load(f)
+            pipe = salvo["pipe"] if salvo.get("versao") == versao else None
+        except Exception:
+            pipe = None
+    if pipe is None:
+        pipe, delta = ml_hashing_novo(), todas
+    if len(delta):
+        with etapa("ml_treino_incremental", linhas=len(delta)):
+            ml_partial_fit(pipe, delta["DE_SERVICO_N"], delta["Comp_Rules"])
+        try:
+            os.makedirs(INCREMENTAL_DIR, exist_ok=True)
+            with open(caminho + ".tmp", "wb") as f:
+                pickle.dump({"versao": versao, "pipe": pipe}, f)
+            os.replace(caminho + ".tmp", caminho)
+        except Exception:
+            pass
+    if not hasattr(pipe.named_steps["clf"], "classes_"):
+        return None
+    return {"pipe": pipe, "pred": {}}
+
+@medir_etapa("carregar_incremental")
+def carregar_incremental(arquivo, nome_base: str, ml_backend: str = None) -> dict:
+    """
+    Carrega um export que é superconjunto do anterior processando só o delta.
+
+    O estado de `nome_base` (linhas já derivadas/classificadas + cubo + série mensal)
+    fica em INCREMENTAL_DIR. Linhas novas ou alteradas passam pelo pipeline; as que
+    sumiram do export saem. Cubo e série mensal são atualizados por soma/subtração.
+    O export é lido com `ler_export` (Excel: todas as abas de OS), como em carregar_varios.
+
+    Com `ml_backend="hashing"` (padrão: ML_BACKEND) o modelo de ML da base também é
+    atualizado só com o delta e volta em "ml" (None no backend TF-IDF).
+
+    Retorna dict com df (não programadas), n_planejadas, cols, comp (Comp_Rules),
+    cubo, mensal, ml e stats (novas/alteradas/removidas/total).
+    """
+    raw = ler_export(arquivo).reset_index(drop=True)
+    raw.columns = raw.columns.str.strip()
+    colunas = sorted(map(str, raw.columns))
+    versao = f"{INGEST_VERSION}:{RULES_VERSION}"
+    chave, h, col_chave = chaves_linhas(raw)
+
+    antigas, meta = _ler_estado(nome_base, versao, colunas)
+    if antigas is None:
+        antigas = pd.DataFrame({"_CHAVE": pd.Series(dtype=object), "_HASH": pd.Series(dtype="uint64")})
+        meta = {}
+
+    # posição de cada linha antiga no export novo (-1 = não veio mais)
+    pos_antigas = pd.Index(chave).get_indexer(antigas["_CHAVE"])
+    iguais = pos_antigas >= 0
+    iguais[iguais] = h[pos_antigas[iguais]] == antigas["_HASH"].to_numpy()[iguais]
+
+    mantidas = antigas[iguais].copy()
+    mantidas.index = pos_antigas[iguais]
+    saem = antigas[~iguais]
+
+    novas_pos = np.setdiff1d(np.arange(len(raw)), mantidas.index.to_numpy())
+    delta, cols = _processar_delta(raw.iloc[novas_pos])
+    delta["_CHAVE"] = chave.to_numpy()[novas_pos]
+    delta["_HASH"] = h[novas_pos]
+
+    # agregados: estado anterior + delta - linhas que saíram/mudaram
+    delta_np, saem_np = delta[~delta["_PLANEJADA"]], saem[~saem["_PLANEJADA"]] if len(saem) else saem
+    if meta.get("cubo") is not None:
+        cubo = combinar_cubos(
+            meta["cubo"],
+            montar_cubo(delta_np, delta_np["Comp_Rules"]) if len(delta_np) else None,
+            montar_cubo(saem_np, saem_np["Comp_Rules"]) if len(saem_np) else None,
+        )
+        mensal = combinar_mensal(
+            meta["mensal"],
+            tabela_mensal(delta_np) if len(delta_np) else None,
+            tabela_mensal(saem_np) if len(saem_np) else None,
+        )
+    else:
+        cubo = montar_cubo(delta_np, delta_np["Comp_Rules"])
+        mensal = tabela_mensal(delta_np)
+
+    blocos = [b for b in (mantidas, delta) if len(b)] or [delta]
+    linhas = _concat_categoricas(blocos).sort_index() if len(blocos) > 1 else blocos[0].sort_index()
+    ml = None
+    if (ml_backend or ML_BACKEND) == "hashing":
+        ml = _atualizar_ml_incremental(nome_base, versao, delta_np, linhas[~linhas["_PLANEJADA"].to_numpy(dtype=bool)],
+                                       recomecar=not meta)
+    _gravar_estado(nome_base, linhas, {
+        "versao": versao, "colunas": colunas, "col_chave": col_chave,
+        "cubo": cubo, "mensal": mensal,
+    })
+
+    removidas = int((pos_antigas < 0).sum())
+    alteradas = int(len(saem) - removidas)
+    planejada = linhas["_PLANEJADA"].to_numpy(dtype=bool)
+    df_np = linhas[~planejada]
+    comp = df_np["Comp_Rules"]
+    df_np = df_np.drop(columns=["_CHAVE", "_HASH", "_PLANEJADA", "Comp_Rules"])
+    return {
+        "df": df_np,
+        "n_planejadas": int(planejada.sum()),
+        "cols": cols,
+        "comp": comp,
+        "cubo": cubo,
+        "mensal": mensal,
+        "ml": ml,
+        "stats": {
+            "novas": int(len(delta) - alteradas),
+            "alteradas": alteradas,
+            "removidas": removidas,
+            "total": len(raw),
+            "chave": col_chave or "hash da linha",
+        },
+    }
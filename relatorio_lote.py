@@ -0,0 +1,137 @@
+"""
+Relatório em lote (sem Streamlit): processa uma pasta de exports de OS em paralelo
+e grava, para cada unidade, as tabelas dos gráficos do dashboard.
+
+Exemplo:
+    python relatorio_lote.py exports/ relatorios/ --workers 8 --ultimas-semanas 4 --altair
+"""
+import argparse
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pipeline
+
+EXTENSOES = (".csv", ".xlsx", ".xls")
+
+
+def _lista_inteiros(txt):
+    return [int(x) for x in txt.split(",") if x.strip()] if txt else []
+
+
+def processar_arquivo(caminho: str, saida: str, opcoes: dict) -> dict:
+    """Roda o pipeline completo para um arquivo (Excel: todas as abas) e grava as tabelas em `saida/<nome do arquivo>/`."""
+    # o paralelismo já é por arquivo: leitura das abas e classificação rodam em série dentro de cada processo
+    pipeline.CLASSIF_WORKERS = 1
+    pipeline.INGEST_WORKERS = 1
+    if opcoes.get("perf_log"):
+        pipeline.iniciar_medicao()
+    if opcoes.get("em_blocos") and caminho.lower().endswith(".csv"):
+        df, n_planejadas, _ = pipeline.carregar_dados_em_blocos(caminho)
+    else:
+        df, n_planejadas, _ = pipeline.carregar_nao_programadas(caminho)
+
+    ano, semanas = opcoes.get("ano"), opcoes.get("semanas")
+    if ano is None:
+        ano, semanas_padrao = pipeline.selecao_padrao(df, opcoes.get("ultimas_semanas", 4))
+        semanas = semanas or semanas_padrao
+    elif not semanas:
+        semanas = pipeline.semanas_disponiveis(df, ano)[-opcoes.get("ultimas_semanas", 4):]
+
+    tabelas = pipeline.gerar_tabelas(
+        df, ano, semanas, opcoes.get("classes"),
+        use_ml=opcoes.get("use_ml", True),
+        ml_threshold=opcoes.get("ml_threshold", 0.6),
+        ml_base_completa=opcoes.get("ml_base_completa", False),
+        ml_backend=opcoes.get("ml_backend"),
+    )
+
+    destino = os.path.join(saida, os.path.splitext(os.path.basename(caminho))[0])
+    os.makedirs(destino, exist_ok=True)
+    for nome, tabela in tabelas.items():
+        tabela.to_csv(os.path.join(destino, f"{nome}.csv"), index=False, encoding="utf-8-sig")
+        if opcoes.get("altair") and nome in pipeline.GRAFICOS and not tabela.empty:
+            with open(os.path.join(destino, f"{nome}.vl.json"), "w", encoding="utf-8") as f:
+                f.write(pipeline.GRAFICOS[nome](tabela).to_json())
+
+    if opcoes.get("perf_log"):
+        pipeline.gravar_medicao(pipeline.finalizar_medicao(), opcoes["perf_log"], arquivo=caminho, linhas_base=len(df))
+
+    return {
+        "arquivo": caminho,
+        "destino": destino,
+        "registros": len(df),
+        "planejadas_removidas": n_planejadas,
+        "ano": ano,
+        "semanas": list(semanas or []),
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Gera as tabelas do dashboard para uma pasta de exports de OS.")
+    ap.add_argument("entrada", help="pasta com os arquivos .csv/.xlsx/.xls (um por unidade)")
+    ap.add_argument("saida", help="pasta de saída (uma subpasta por arquivo)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="processos em paralelo (padrão: nº de CPUs)")
+    ap.add_argument("--ano", type=int, default=None, help="ano ISO (padrão: o último presente em cada arquivo)")
+    ap.add_argument("--semanas", type=_lista_inteiros, default=None, help="semanas ISO, ex.: 10,11,12")
+    ap.add_argument("--ultimas-semanas", type=int, default=4, help="sem --semanas: usa as N últimas do ano (padrão: 4)")
+    ap.add_argument("--classes", type=_lista_inteiros, default=None, help="códigos CD_CLASMANU, ex.: 12,18")
+    ap.add_argument("--sem-ml", action="store_true", help="não reclassificar 'Não Classificado' com ML")
+    ap.add_argument("--ml-threshold", type=float, default=0.6, help="confiança mínima do ML (padrão: 0.6)")
+    ap.add_argument("--ml-base-completa", action="store_true", help="treinar o ML na base inteira do arquivo")
+    ap.add_argument("--ml-backend", choices=["tfidf", "hashing"], default=None,
+                    help="modelo do ML: tfidf ou hashing (memória limitada); padrão: DASH_ML_BACKEND ou tfidf")
+    ap.add_argument("--em-blocos", action="store_true", help="leitura em blocos para CSV grande")
+    ap.add_argument("--altair", action="store_true", help="gravar também as specs Vega-Lite (.vl.json)")
+    ap.add_argument("--perf-log", default=None, help="acrescenta tempos/cache por etapa neste arquivo JSON lines")
+    args = ap.parse_args(argv)
+
+    arquivos = sorted(
+        os.path.join(args.entrada, f) for f in os.listdir(args.entrada)
+        if f.lower().endswith(EXTENSOES)
+    )
+    if not arquivos:
+        print(f"Nenhum arquivo {', '.join(EXTENSOES)} em {args.entrada}", file=sys.stderr)
+        return 1
+    # a pasta de saída é o nome sem extensão: unidade.csv e unidade.xlsx gravariam na mesma subpasta
+    por_nome = {}
+    for a in arquivos:
+        por_nome.setdefault(os.path.splitext(os.path.basename(a))[0].lower(), []).append(os.path.basename(a))
+    repetidos = [nomes for nomes in por_nome.values() if len(nomes) > 1]
+    if repetidos:
+        for nomes in repetidos:
+            print(f"Arquivos com o mesmo nome (mesma pasta de saída): {', '.join(nomes)}", file=sys.stderr)
+        return 1
+
+    opcoes = {
+        "ano": args.ano,
+        "semanas": args.semanas,
+        "ultimas_semanas": args.ultimas_semanas,
+        "classes": args.classes,
+        "use_ml": not args.sem_ml,
+        "ml_threshold": args.ml_threshold,
+        "ml_base_completa": args.ml_base_completa,
+        "ml_backend": args.ml_backend,
+        "em_blocos": args.em_blocos,
+        "altair": args.altair,
+        "perf_log": args.perf_log,
+    }
+
+    falhas = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers or 1)) as pool:
+        futuros = {pool.submit(processar_arquivo, a, args.saida, opcoes): a for a in arquivos}
+        for fut in as_completed(futuros):
+            try:
+                r = fut.result()
+                print(f"OK   {r['arquivo']}: {r['registros']} OS (planejadas removidas: {r['planejadas_removidas']}), "
+                      f"ano {r['ano']} semanas {r['semanas']} -> {r['destino']}")
+            except Exception:
+                falhas += 1
+                print(f"ERRO {futuros[fut]}", file=sys.stderr)
+                traceback.print_exc()
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
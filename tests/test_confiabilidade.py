@@ -0,0 +1,102 @@
+"""Eventos de parada (OS sobrepostas juntas) contra um laço simples por equipamento."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+
+
+def _base(n=400, seed=3):
+    rng = np.random.default_rng(seed)
+    entrada = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 60 * 24, n), unit="h")
+    saida = pd.Series(entrada + pd.to_timedelta(rng.gamma(1.5, 20.0, n), unit="h"))
+    saida[rng.random(n) < 0.1] = pd.NaT
+    df = pd.DataFrame({
+        "CD_EQUIPTO": rng.choice(["A", "B", "C", "Não informado"], n, p=[0.5, 0.3, 0.15, 0.05]),
+        "ENTRADA": entrada,
+        "SAIDA": saida.to_numpy(),
+        "ISO_ANO": 2024,
+        "ISO_SEMANA": entrada.isocalendar().week.to_numpy(),
+        "CD_CLASMANU_CODE": 12,
+    })
+    comp = pd.Series(rng.choice(["Elétrica", "Motor"], n), index=df.index)
+    return df, comp
+
+
+def _eventos_laco(df, comp, chave):
+    df = df.assign(Componente=comp)
+    df = df[df["CD_EQUIPTO"] != "Não informado"]
+    out = []
+    for _, g in df.sort_values(chave + ["ENTRADA"], kind="stable").groupby(chave, sort=False):
+        fim_ant, atual = None, None
+        for r in g.itertuples():
+            fim = r.SAIDA if pd.notna(r.SAIDA) else r.ENTRADA
+            if atual is not None and r.ENTRADA <= atual["fim"]:
+                atual["fim"] = max(atual["fim"], fim)
+                atual["os"] += 1
+                atual["com_saida"] |= pd.notna(r.SAIDA)
+                continue
+            if atual is not None:
+                out.append(atual)
+                fim_ant = atual["fim"]
+            atual = {"equip": r.CD_EQUIPTO, "comp": r.Componente, "inicio": r.ENTRADA, "fim": fim, "os": 1,
+                     "com_saida": pd.notna(r.SAIDA), "fim_ant": fim_ant}
+        out.append(atual)
+    for e in out:
+        e["ttr"] = (e["fim"] - e["inicio"]).total_seconds() / 3600 if e["com_saida"] else np.nan
+        e["tbf"] = (e["inicio"] - e["fim_ant"]).total_seconds() / 3600 if e["fim_ant"] is not None else np.nan
+    return out
+
+
+@pytest.mark.parametrize("por", ["equipamento", "componente"])
+def test_eventos_igual_ao_laco(por):
+    df, comp = _base()
+    ev = pipeline.eventos_confiabilidade(df, comp, por)
+    ref = _eventos_laco(df, comp, pipeline.CHAVES_CONFIABILIDADE[por])
+
+    assert len(ev) == len(ref)
+    assert ev["OS"].sum() == (df["CD_EQUIPTO"] != "Não informado").sum()
+    np.testing.assert_array_equal(ev["ENTRADA"].to_numpy(), np.array([e["inicio"] for e in ref], dtype="datetime64[ns]"))
+    np.testing.assert_array_equal(ev["OS"].to_numpy(), [e["os"] for e in ref])
+    np.testing.assert_allclose(ev["TTR"].to_numpy(dtype=float), [e["ttr"] for e in ref], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(ev["TBF"].to_numpy(dtype=float), [e["tbf"] for e in ref], rtol=1e-9, atol=1e-9)
+    assert (ev["TBF"].dropna() > 0).all()
+
+
+def test_paradas_sobrepostas_nao_somam_duas_vezes():
+    df = pd.DataFrame({
+        "CD_EQUIPTO": ["A", "A", "A"],
+        "ENTRADA": pd.to_datetime(["2024-01-01 00:00", "2024-01-01 02:00", "2024-01-03 00:00"]),
+        "SAIDA": pd.to_datetime(["2024-01-01 10:00", "2024-01-01 04:00", "2024-01-03 06:00"]),
+        "ISO_ANO": 2024, "ISO_SEMANA": 1, "CD_CLASMANU_CODE": 12,
+    })
+    tab = pipeline.tabela_confiabilidade(
+        pipeline.eventos_confiabilidade(df, pd.Series("Motor", index=df.index)), "equipamento")
+    linha = tab.iloc[0]
+    assert (linha["Falhas"], linha["OS"]) == (2, 3)
+    assert linha["Horas paradas"] == pytest.approx(16.0)
+    assert linha["MTBF (h)"] == pytest.approx(38.0)
+
+
+def test_sem_eventos():
+    df, comp = _base(10)
+    ev = pipeline.eventos_confiabilidade(df.iloc[0:0], comp.iloc[0:0])
+    assert ev.empty
+    assert pipeline.tabela_confiabilidade(ev).empty
+
+
+def test_sem_coluna_entrada():
+    df, comp = _base(10)
+    ev = pipeline.eventos_confiabilidade(df.drop(columns=["ENTRADA"]), comp)
+    assert ev.empty
+    assert {"ENTRADA", "FIM", "OS", "TTR", "TBF"} <= set(ev.columns)
+    assert pipeline.tabela_confiabilidade(ev[pipeline.mascara_filtro(ev, 2024, [1], None)]).empty
+
+
+
+def test_horas_em_float64():
+    df, comp = _base()
+    ev = pipeline.eventos_confiabilidade(df, comp)
+    assert ev["TTR"].dtype == ev["TBF"].dtype == "float64"
+    tab = pipeline.tabela_confiabilidade(ev)
+    assert (tab[["MTBF (h)", "MTTR (h)", "Horas paradas"]].dtypes == "float64").all()
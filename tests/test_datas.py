@@ -0,0 +1,29 @@
+"""Conversão de ENTRADA/SAIDA (converter_datas)."""
+import pandas as pd
+
+import pipeline
+
+
+def test_texto_com_formato_e_series_do_excel():
+    datas, info = pipeline.converter_datas(pd.Series(["01/02/2024 10:00", "45292", " 45292.5 ", "", None]))
+    assert info["formato"] == "%d/%m/%Y %H:%M"
+    assert datas.tolist()[:3] == [pd.Timestamp("2024-02-01 10:00"), pd.Timestamp("2024-01-01"),
+                                  pd.Timestamp("2024-01-01 12:00")]
+    assert datas.iloc[3:].isna().all()
+
+
+def test_numero_fora_da_faixa_de_series_nao_vira_data():
+    datas, _ = pipeline.converter_datas(pd.Series(["01/02/2024 10:00", "2024", "1", "9999999"]))
+    assert datas.iloc[1:].isna().all()
+    numericas, info = pipeline.converter_datas(pd.Series([2024, 1, 45292.25]))
+    assert info["formato"] == "serial Excel"
+    assert numericas.iloc[:2].isna().all()
+    assert numericas.iloc[2] == pd.Timestamp("2024-01-01 06:00")
+
+
+def test_coluna_texto_toda_vazia():
+    datas, info = pipeline.converter_datas(pd.Series([None, None, float("nan")], dtype=object))
+    assert info == {"formato": "tolerante", "fallback": 0}
+    assert datas.dtype == "datetime64[ns]" and len(datas) == 3 and datas.isna().all()
+    vazia, _ = pipeline.converter_datas(pd.Series([], dtype=object))
+    assert vazia.empty
@@ -0,0 +1,62 @@
+"""Modo incremental (carregar_incremental) contra o carregamento completo do último export."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import pipeline
+
+
+@pytest.fixture
+def estado_isolado(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "INCREMENTAL_DIR", str(tmp_path / "incremental"))
+    monkeypatch.setattr(pipeline, "INGEST_CACHE_DIR", str(tmp_path / "ingest"))
+
+
+def _valores(serie: pd.Series) -> pd.Series:
+    return serie.astype(object).reset_index(drop=True)
+
+
+def _cubo_ordenado(info: dict) -> pd.DataFrame:
+    cubo = info["cubo"].copy()
+    for col in pipeline.CUBE_KEYS:
+        cubo[col] = cubo[col].astype(str)
+    return cubo.sort_values(pipeline.CUBE_KEYS, kind="stable").reset_index(drop=True)
+
+
+def test_superconjunto_igual_ao_carregamento_completo(estado_isolado, tmp_path):
+    os_ = benchmark.gerar_os(2100, seed=11)
+    a, b = tmp_path / "a.csv", tmp_path / "b.csv"
+    benchmark.gravar_os(os_.iloc[:2000], str(a))
+
+    # B = A sem 50 OS, com uma OS alterada (reaberta) e 100 OS novas ainda abertas
+    novo = os_.drop(index=range(100, 150)).copy()
+    novo.loc[5, ["DE_SERVICO", "SAIDA"]] = ["troca da mangueira hidraulica", ""]
+    novo.loc[novo.index >= 2000, "SAIDA"] = ""
+    benchmark.gravar_os(novo, str(b))
+
+    primeiro = pipeline.carregar_incremental(str(a), "base")
+    assert primeiro["stats"]["novas"] == 2000
+    inc = pipeline.carregar_incremental(str(b), "base")
+    assert {k: inc["stats"][k] for k in ("novas", "alteradas", "removidas")} == {
+        "novas": 100, "alteradas": 1, "removidas": 50}
+
+    ref, n_planejadas, _ = pipeline.carregar_nao_programadas(str(b))
+    assert inc["n_planejadas"] == n_planejadas
+    assert inc["df"].index.equals(ref.index)
+    assert list(inc["df"].columns) == list(ref.columns)
+    for col in ref.columns:
+        assert _valores(inc["df"][col]).equals(_valores(ref[col])), col
+
+    comp = pipeline.classify_rules_batch(ref["DE_SERVICO_N"])
+    assert _valores(inc["comp"]).equals(_valores(pd.Series(comp, index=ref.index)))
+
+    cubo, cubo_ref = _cubo_ordenado(inc["cubo"]), _cubo_ordenado(pipeline.montar_cubo(ref, comp))
+    assert cubo[pipeline.CUBE_KEYS].equals(cubo_ref[pipeline.CUBE_KEYS])
+    assert cubo["OS"].tolist() == cubo_ref["OS"].tolist()
+    assert cubo["Horas_n"].tolist() == cubo_ref["Horas_n"].tolist()
+    np.testing.assert_allclose(cubo["Horas"].to_numpy(), cubo_ref["Horas"].to_numpy(), rtol=1e-9, atol=1e-6)
+    assert set(inc["cubo"]["semanas"]) == set(pipeline.montar_cubo(ref, comp)["semanas"])
+
+    pd.testing.assert_frame_equal(inc["mensal"].reset_index(drop=True),
+                                  pipeline.tabela_mensal(ref).reset_index(drop=True), check_dtype=False)
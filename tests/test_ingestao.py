@@ -0,0 +1,132 @@
+"""Vários arquivos/abas (carregar_varios) contra o export único equivalente."""
+import pandas as pd
+import pytest
+
+import benchmark
+import pipeline
+
+
+@pytest.fixture
+def cache_isolado(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "INGEST_CACHE_DIR", str(tmp_path / "ingest"))
+
+
+@pytest.fixture
+def exports(tmp_path):
+    """Mesmo export inteiro e dividido: a.csv, b.csv (sem TP_OS, nomes em minúsculas) e c.xlsx (2 abas + resumo)."""
+    os_ = benchmark.gerar_os(3000, seed=7)
+    inteiro = tmp_path / "inteiro.csv"
+    benchmark.gravar_os(os_, str(inteiro))
+
+    a, b, c = tmp_path / "a.csv", tmp_path / "b.csv", tmp_path / "c.xlsx"
+    benchmark.gravar_os(os_.iloc[:1000], str(a))
+    (os_.iloc[1000:2000]
+        .drop(columns=["TP_OS"])
+        .rename(columns={"DE_SERVICO": "de_servico ", "ENTRADA": "Entrada"})
+        .to_csv(b, sep=";", encoding="latin1", index=False))
+    with pd.ExcelWriter(c) as w:
+        os_.iloc[2000:2500].to_excel(w, sheet_name="jan", index=False)
+        pd.DataFrame({"Total": [1, 2]}).to_excel(w, sheet_name="Resumo", index=False)
+        os_.iloc[2500:].to_excel(w, sheet_name="fev", index=False)
+    return str(inteiro), [str(a), str(b), str(c)]
+
+
+def _valores(serie: pd.Series) -> pd.Series:
+    return serie.astype(object).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_partes_igual_ao_export_unico(cache_isolado, exports, workers):
+    inteiro, partes = exports
+    ref = pipeline.carregar_dados(inteiro)
+    df, origem = pipeline.carregar_varios(partes, workers=workers)
+
+    assert len(df) == len(ref)
+    assert df.index.is_unique
+    assert list(df.columns) == list(ref.columns)
+    assert df.dtypes.to_dict() == ref.dtypes.to_dict()
+    for col in ref.columns:
+        if col == "TP_OS":
+            continue
+        assert _valores(df[col]).equals(_valores(ref[col])), col
+    # coluna ausente em b.csv: nula só nas linhas dela
+    tp = _valores(df["TP_OS"])
+    assert tp.iloc[1000:2000].isna().all()
+    assert tp.drop(range(1000, 2000)).equals(_valores(ref["TP_OS"]).drop(range(1000, 2000)))
+
+    assert [o["origem"] for o in origem] == ["a.csv", "b.csv", "c.xlsx [jan]", "c.xlsx [Resumo]", "c.xlsx [fev]"]
+    assert [o["linhas"] for o in origem] == [1000, 1000, 500, 0, 500]
+
+
+def test_partes_vem_do_cache(cache_isolado, exports):
+    _, partes = exports
+    pipeline.carregar_varios(partes, workers=1)
+    df, origem = pipeline.carregar_varios(partes + partes[:1], workers=1)  # repetido entra uma vez
+    assert all(o["cache"] for o in origem)
+    assert len(df) == 3000
+
+
+def test_filtro_de_planejadas_nas_partes(cache_isolado, exports):
+    inteiro, partes = exports
+    ref_np, ref_plan, _ = pipeline.carregar_nao_programadas(inteiro)
+    df_np, n_plan, cols, _ = pipeline.carregar_nao_programadas_varios(partes, workers=1)
+    # b.csv não tem TP_OS: as planejadas dele só saem pela descrição
+    assert "TP_OS" in cols
+    assert len(df_np) + n_plan == 3000
+    assert n_plan <= ref_plan
+
+
+def test_reconcilia_nomes_de_colunas():
+    raw = pd.DataFrame(columns=[" de_servico", "Entrada ", "tipo de MANUTENÇÃO", "Outra"])
+    assert list(pipeline._reconciliar_colunas(raw).columns) == [
+        "DE_SERVICO", "ENTRADA", "Tipo de manutenção", "Outra"]
+
+
+def test_codigo_de_classe_grande(cache_isolado, tmp_path):
+    caminho = tmp_path / "grande.csv"
+    caminho.write_text(
+        "CD_EQUIPTO;CD_CLASMANU;DE_SERVICO;ENTRADA;SAIDA\n"
+        "1;40012;troca de mangueira;01/02/2024 10:00;01/02/2024 12:00\n"
+        "2;12;vazamento oleo;02/02/2024 10:00;02/02/2024 11:00\n",
+        encoding="latin1",
+    )
+    assert pipeline.carregar_dados(str(caminho))["CD_CLASMANU_CODE"].tolist() == [40012, 12]
+    blocos, _, _ = pipeline.carregar_dados_em_blocos(str(caminho), chunksize=1)
+    assert blocos["CD_CLASMANU_CODE"].tolist() == [40012, 12]
+
+
+def test_coluna_com_tipos_misturados_vai_para_o_cache(cache_isolado, tmp_path):
+    caminho = tmp_path / "obs.xlsx"
+    os_ = benchmark.gerar_os(200, seed=5)
+    os_["OBS"] = [7 if i % 3 == 0 else ("ver oficina" if i % 3 == 1 else None) for i in range(len(os_))]
+    os_.to_excel(caminho, index=False)
+
+    pipeline.iniciar_medicao()
+    try:
+        primeira = pipeline.carregar_dados(str(caminho))
+        segunda = pipeline.carregar_dados(str(caminho))
+    finally:
+        caches = {r["etapa"]: r for r in pipeline.finalizar_medicao() if r["tipo"] == "cache"}
+    assert (caches["ingestao_feather"]["hits"], caches["ingestao_feather"]["misses"]) == (1, 1)
+    assert caches["ingestao_feather"]["falhas"] == 0
+    assert primeira["OBS"].tolist()[:2] == ["7", "ver oficina"] and pd.isna(primeira["OBS"].iloc[2])
+    assert _valores(segunda["OBS"]).equals(_valores(primeira["OBS"]))
+
+
+def test_incremental_e_blocos_reconciliam_como_as_partes(cache_isolado, exports, tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "INCREMENTAL_DIR", str(tmp_path / "incremental"))
+    _, (_, b, c) = exports
+
+    # Excel com várias abas: o incremental lê todas as abas de OS (sem o resumo)
+    ref, n_plan, _ = pipeline.carregar_nao_programadas(c)
+    inc = pipeline.carregar_incremental(c, "c")
+    assert len(inc["df"]) == len(ref) and inc["n_planejadas"] == n_plan
+    assert _valores(inc["df"]["DE_SERVICO"]).equals(_valores(ref["DE_SERVICO"]))
+
+    # CSV com "de_servico " e "Entrada": a leitura em blocos não perde as colunas
+    ref, n_plan, _ = pipeline.carregar_nao_programadas(b)
+    blocos, n_plan_blocos, _ = pipeline.carregar_dados_em_blocos(b, chunksize=300)
+    assert (len(blocos), n_plan_blocos) == (len(ref), n_plan)
+    assert blocos["DE_SERVICO"].ne("").all()
+    assert _valores(blocos["DE_SERVICO"]).equals(_valores(ref["DE_SERVICO"]))
+    assert _valores(blocos["ENTRADA"]).equals(_valores(ref["ENTRADA"]))
@@ -0,0 +1,43 @@
+"""Medição por etapa: o tracemalloc é do processo e só a thread que o ligou o usa."""
+import threading
+import tracemalloc
+
+import pipeline
+
+
+def _em_thread(fn):
+    out = {}
+    t = threading.Thread(target=lambda: out.setdefault("r", fn()))
+    t.start()
+    t.join()
+    return out["r"]
+
+
+def test_outra_thread_nao_zera_o_pico_nem_desliga():
+    def outra_sessao():
+        pipeline.iniciar_medicao(memoria=True)  # já em uso pela thread principal: só tempo
+        with pipeline.etapa("outra"):
+            pass
+        return pipeline.finalizar_medicao()
+
+    pipeline.iniciar_medicao(memoria=True)
+    try:
+        with pipeline.etapa("grande") as reg:
+            bloco = bytearray(32 * 2**20)
+            del bloco
+            registros_outra = _em_thread(outra_sessao)
+            assert tracemalloc.is_tracing()
+    finally:
+        registros = pipeline.finalizar_medicao()
+    assert not tracemalloc.is_tracing()
+    assert reg["mem_pico_mb"] >= 32
+    assert "mem_pico_mb" not in registros_outra[0]
+    assert registros[0]["etapa"] == "grande"
+
+
+def test_nova_medicao_sem_memoria_desliga_o_tracemalloc_da_thread():
+    # execução anterior da mesma thread interrompida antes de finalizar_medicao
+    pipeline.iniciar_medicao(memoria=True)
+    pipeline.iniciar_medicao()
+    assert not tracemalloc.is_tracing()
+    pipeline.finalizar_medicao()
@@ -0,0 +1,67 @@
+"""Pré-filtro por palavras-chave (âncoras + Aho–Corasick) contra o laço simples por regex."""
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import pipeline
+
+
+def _vocabulario():
+    """Palavras tiradas dos próprios padrões (com e sem acento) + ruído."""
+    palavras = set()
+    for pats in pipeline._RULES.values():
+        for p in pats:
+            fonte = re.sub(r"\\[bsdw]|\(\?!\w+\)|[()?|*+.^$\\]", " ", p.pattern)
+            for trecho in re.sub(r"\[(\w)\w*\]", r"\1", fonte).split():
+                palavras.add(trecho)
+            for trecho in re.sub(r"\[\w*?(\w)\]", r"\1", fonte).split():
+                palavras.add(trecho)
+    palavras = {w for w in palavras if not re.search(r"[\[\]{}]", w)}
+    return sorted(palavras) + ["de", "do", "troca", "revisao", "os", "cabine", "motorista", "oleo", "hidraulico"]
+
+
+@pytest.fixture(scope="module")
+def textos():
+    rng = np.random.default_rng(13)
+    vocab = np.array(_vocabulario(), dtype=object)
+    sinteticos = [" ".join(rng.choice(vocab, rng.integers(1, 6))) for _ in range(20000)]
+    export = benchmark.gerar_os(20000, seed=5)["DE_SERVICO"]
+    return list(vocab) + sinteticos + pipeline.norm_txt_serie(export).tolist()
+
+
+def test_ancoras_cobrem_todo_match(textos):
+    regras = list(pipeline._RULES.values())
+    for t in textos:
+        candidatas = set(pipeline.categorias_candidatas(t))
+        for i, pats in enumerate(regras):
+            if i not in candidatas:
+                assert not any(p.search(t) for p in pats), (t, list(pipeline._RULES)[i])
+
+
+def test_classificacao_igual_ao_laco_por_regex(textos, monkeypatch):
+    indexado = [pipeline.classify_norm(t) for t in textos]
+    # laço simples: todas as categorias, na ordem de prioridade, sem pré-filtro
+    todas = list(range(len(pipeline._KW_INDEX["categorias"])))
+    monkeypatch.setattr(pipeline, "categorias_candidatas", lambda t, indice=None: todas)
+    assert [pipeline.classify_norm(t) for t in textos] == indexado
+
+
+def test_classify_rules_batch_igual_ao_apply(textos):
+    serie = pd.Series(textos[:5000])
+    lote = pipeline.classify_rules_batch(serie, use_cache=False, workers=1)
+    assert lote.tolist() == [pipeline.classify_norm(t) for t in serie]
+
+
+def test_pool_indisponivel_cai_na_serie_com_progresso(textos, monkeypatch):
+    def sem_pool():
+        raise OSError("sem processos")
+
+    monkeypatch.setattr(pipeline, "contexto_processos", sem_pool)
+    avisos = []
+    out = pipeline.classify_norm_many(textos[:5000], workers=2, min_paralelo=2,
+                                      progresso=lambda feitos, total: avisos.append((feitos, total)))
+    assert out == [pipeline.classify_norm(t) for t in textos[:5000]]
+    assert len(avisos) > 1 and avisos[-1] == (5000, 5000)
@@ -0,0 +1,15 @@
+import os
+
+import relatorio_lote
+
+
+def test_nomes_repetidos_rejeitados(tmp_path, capsys):
+    entrada, saida = tmp_path / "entrada", tmp_path / "saida"
+    entrada.mkdir()
+    (entrada / "unidade.csv").write_text("x\n")
+    (entrada / "Unidade.xlsx").write_bytes(b"")
+    (entrada / "outra.csv").write_text("x\n")
+
+    assert relatorio_lote.main([str(entrada), str(saida), "--workers", "1"]) == 1
+    assert "Unidade.xlsx, unidade.csv" in capsys.readouterr().err
+    assert not os.path.exists(saida)